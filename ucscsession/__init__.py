@@ -1,2 +1,7 @@
+import logging
 from version import version as __version__
-from session import UCSCSession
+from session import UCSCSession, new_session, from_state, fan_out
+from pool import SessionPool
+
+# Library logging is silent unless the application configures logging
+logging.getLogger(__name__).addHandler(logging.NullHandler())
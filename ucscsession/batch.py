@@ -0,0 +1,91 @@
+"""
+Helpers for running many independent requests through a bounded thread pool.
+"""
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BatchResult(object):
+    """
+    Outcome of running a function on a single item in a batch.
+
+    `value` is whatever the function returned, `error` is the exception it
+    raised (or None), and `elapsed` is wall time in seconds.
+    """
+    __slots__ = ['item', 'value', 'error', 'elapsed']
+
+    def __init__(self, item, value=None, error=None, elapsed=0.0):
+        self.item = item
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            status = 'ok'
+        else:
+            status = 'failed: %r' % self.error
+        return '<BatchResult %r (%.2fs) %s>' % (self.item, self.elapsed, status)
+
+
+class BatchResults(list):
+    """
+    List of BatchResult objects, in the same order as the input items.
+    """
+    @property
+    def succeeded(self):
+        return [i for i in self if i.ok]
+
+    @property
+    def failed(self):
+        return [i for i in self if not i.ok]
+
+    def raise_for_errors(self):
+        """
+        Raise a ValueError summarizing all failures, if there were any.
+        """
+        failed = self.failed
+        if failed:
+            raise ValueError(
+                '%s of %s items failed:\n%s'
+                % (len(failed), len(self),
+                   '\n'.join('  %r: %r' % (i.item, i.error) for i in failed)))
+
+
+def _timed_call(func, item):
+    t0 = time.time()
+    try:
+        value = func(item)
+    except Exception as e:
+        elapsed = time.time() - t0
+        logger.debug('%r failed after %.2fs: %r' % (item, elapsed, e))
+        return BatchResult(item, error=e, elapsed=elapsed)
+    elapsed = time.time() - t0
+    logger.debug('%r finished in %.2fs' % (item, elapsed))
+    return BatchResult(item, value=value, elapsed=elapsed)
+
+
+def run_batch(func, items, workers=4):
+    """
+    Call `func(item)` for each of `items` using `workers` threads.
+
+    Exceptions are caught and recorded on the corresponding result rather
+    than stopping the batch.  Returns a BatchResults list.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return BatchResults(_timed_call(func, i) for i in items)
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        results = pool.map(lambda i: _timed_call(func, i), items)
+    finally:
+        pool.close()
+        pool.join()
+    return BatchResults(results)
@@ -0,0 +1,136 @@
+"""
+Local model of the server-side cart.
+"""
+import logging
+from collections import Mapping
+
+logger = logging.getLogger(__name__)
+
+
+class Cart(Mapping):
+    """
+    Read-only mapping of the cart variables in a session.
+
+    `fetch` is a callable that returns a dictionary of the cart as currently
+    stored on the server (e.g., _UCSCSession.cart_info).  It is only called
+    when a value is needed that isn't known locally, or when sync() is called
+    explicitly -- so creating a Cart costs nothing.
+
+    Changes made through the session (set_genome, set_position, etc) are
+    recorded with set_local(), so reading them back doesn't require a
+    request.  Operations whose effects on the cart can't be predicted locally
+    (zooming, logging in, uploading tracks) call invalidate() so that the
+    next read re-syncs from the server.
+
+    `pending` is an optional callable returning a dictionary of changes
+    that have been recorded with set_local() but not yet sent (e.g., those
+    gathered in a _UCSCSession.batch() block); they survive a sync.
+    """
+    def __init__(self, fetch, pending=None):
+        self._fetch = fetch
+        self._pending = pending
+        self._data = {}
+        self._dirty = {}
+        self._synced = False
+
+    def __repr__(self):
+        if not self._synced:
+            return '<Cart (not synced; %s local changes)>' % len(self._dirty)
+        return '<Cart (%s items)>' % len(self._data)
+
+    def __getitem__(self, key):
+        if key in self._dirty:
+            return self._dirty[key]
+        if not self._synced:
+            self.sync()
+        return self._data[key]
+
+    def __iter__(self):
+        if not self._synced:
+            self.sync()
+        return iter(self._data)
+
+    def __len__(self):
+        if not self._synced:
+            self.sync()
+        return len(self._data)
+
+    @property
+    def dirty(self):
+        """
+        Keys changed locally since the last sync.
+        """
+        return set(self._dirty)
+
+    def set_local(self, **kwargs):
+        """
+        Record cart variables that have just been sent to the server.
+
+        None values are ignored since they are not sent.
+        """
+        for k, v in kwargs.items():
+            if v is None:
+                continue
+            v = str(v)
+            self._dirty[k] = v
+            self._data[k] = v
+
+    def peek(self, key, default=None):
+        """
+        Return the value of `key` if it is known locally, or `default` if
+        finding out would need a sync.
+        """
+        if key in self._dirty:
+            return self._dirty[key]
+        if self._synced:
+            return self._data.get(key, default)
+        return default
+
+    def snapshot(self):
+        """
+        Return a copy of the cart as last synced (including local changes),
+        or None if it hasn't been synced.
+        """
+        if not self._synced:
+            return None
+        return dict(self._data)
+
+    def restore(self, data):
+        """
+        Use `data` (e.g., from snapshot()) as the synced cart, without
+        fetching it from the server.
+        """
+        self._data = dict(data)
+        self._dirty = {}
+        self._synced = True
+
+    def invalidate(self):
+        """
+        Forget the local model, including local changes, since the server's
+        cart may have changed in ways that can't be predicted.  The next read
+        will re-sync.
+        """
+        self._dirty = {}
+        self._synced = False
+
+    def sync(self):
+        """
+        Fetch the cart from the server, replacing the local model.
+
+        Local changes that the server doesn't agree with are logged, and the
+        server's values are kept -- except for changes that haven't been
+        sent yet, which are kept as local changes.
+        """
+        data = self._fetch()
+        pending = {}
+        if self._pending is not None:
+            pending = self._pending()
+        for k, v in self._dirty.items():
+            if (k not in pending) and (data.get(k) != v):
+                logger.debug('cart diverged for %s: local=%r, server=%r'
+                             % (k, v, data.get(k)))
+        self._data = data
+        self._dirty = {}
+        self._synced = True
+        self.set_local(**pending)
+        return self
@@ -0,0 +1,92 @@
+"""
+Persistent cache of the tracks available for an assembly on a mirror.
+
+Track ids, labels, titles, visibility options and config page URLs rarely
+change, so once they have been parsed from an hgTracks page they can be
+stored on disk and re-used by later processes without any network access.
+"""
+import re
+import json
+import time
+import sqlite3
+import logging
+from tracks import TrackRecord
+
+logger = logging.getLogger(__name__)
+
+_HGSID = re.compile(r'hgsid=[^&]*&?')
+
+
+class TrackCatalog(object):
+    """
+    SQLite-backed store of TrackRecords, keyed by (mirror, db).
+
+    Entries older than `ttl` seconds are ignored.  Config page URLs are stored
+    without the hgsid, since that belongs to the session that created them.
+    """
+    def __init__(self, filename, ttl=7 * 24 * 3600):
+        self.filename = filename
+        self.ttl = ttl
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS catalog '
+            '(mirror TEXT, db TEXT, updated REAL, records TEXT, '
+            'PRIMARY KEY (mirror, db))')
+        conn.commit()
+        conn.close()
+
+    def __repr__(self):
+        return '<TrackCatalog %s (ttl=%ss)>' % (self.filename, self.ttl)
+
+    def _connect(self):
+        return sqlite3.connect(self.filename, timeout=30)
+
+    def get(self, mirror, db):
+        """
+        Return the list of TrackRecords for `db` on `mirror`, or None if
+        there's no entry or it has expired.
+        """
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT updated, records FROM catalog WHERE mirror=? AND db=?',
+            (mirror, db)).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        updated, records = row
+        if time.time() - updated > self.ttl:
+            logger.debug('catalog for %s on %s has expired' % (db, mirror))
+            return None
+        return [TrackRecord(*i)._replace(visibility_options=tuple(i[-1]))
+                for i in json.loads(records)]
+
+    def put(self, mirror, db, records):
+        """
+        Store `records` (an iterable of TrackRecords) for `db` on `mirror`,
+        replacing any existing entry.
+        """
+        records = [i._replace(url=_HGSID.sub('', i.url)) for i in records]
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO catalog VALUES (?, ?, ?, ?)',
+            (mirror, db, time.time(), json.dumps(records)))
+        conn.commit()
+        conn.close()
+
+    def invalidate(self, mirror=None, db=None):
+        """
+        Remove entries; if `mirror` and/or `db` are given, only remove
+        matching entries.
+        """
+        query = 'DELETE FROM catalog WHERE 1'
+        args = []
+        if mirror is not None:
+            query += ' AND mirror=?'
+            args.append(mirror)
+        if db is not None:
+            query += ' AND db=?'
+            args.append(db)
+        conn = self._connect()
+        conn.execute(query, args)
+        conn.commit()
+        conn.close()
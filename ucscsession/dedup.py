@@ -0,0 +1,107 @@
+"""
+Index of custom tracks that have already been uploaded, so identical tracks
+aren't uploaded again to the same session.
+"""
+import json
+import time
+import sqlite3
+import threading
+
+
+class UploadIndex(object):
+    """
+    Maps the content digest of an uploaded track (see
+    ucscsession.upload.track_digest) to the custom track cart variables
+    ("ct_*") that the upload created, keyed by mirror, hgsid and assembly.
+
+    If `filename` is None, the index is kept in memory for the life of the
+    object; otherwise it is stored in a SQLite database so that it can be
+    shared across processes that use the same hgsid.
+    """
+    def __init__(self, filename=None):
+        self.filename = filename
+        self._memory = {}
+        self._lock = threading.Lock()
+        if filename is not None:
+            conn = self._connect()
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS uploads '
+                '(mirror TEXT, hgsid TEXT, db TEXT, digest TEXT, '
+                'keys TEXT, updated REAL, '
+                'PRIMARY KEY (mirror, hgsid, db, digest))')
+            conn.commit()
+            conn.close()
+
+    def __repr__(self):
+        return '<UploadIndex %s>' % (self.filename or '(in memory)')
+
+    def _connect(self):
+        return sqlite3.connect(self.filename, timeout=30)
+
+    def get(self, mirror, hgsid, db, digest):
+        """
+        Return the list of cart variables created by uploading `digest`, or
+        None if it hasn't been uploaded.
+        """
+        key = (mirror, str(hgsid), db, digest)
+        if self.filename is None:
+            with self._lock:
+                return self._memory.get(key)
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT keys FROM uploads '
+            'WHERE mirror=? AND hgsid=? AND db=? AND digest=?', key).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, mirror, hgsid, db, digest, keys):
+        """
+        Record that uploading `digest` created cart variables `keys`.
+        """
+        key = (mirror, str(hgsid), db, digest)
+        keys = sorted(keys)
+        if self.filename is None:
+            with self._lock:
+                self._memory[key] = keys
+            return
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?)',
+            key + (json.dumps(keys), time.time()))
+        conn.commit()
+        conn.close()
+
+    def discard(self, mirror, hgsid, db, digest):
+        """
+        Forget about `digest`, e.g. because its tracks have been deleted.
+        """
+        key = (mirror, str(hgsid), db, digest)
+        if self.filename is None:
+            with self._lock:
+                self._memory.pop(key, None)
+            return
+        conn = self._connect()
+        conn.execute(
+            'DELETE FROM uploads '
+            'WHERE mirror=? AND hgsid=? AND db=? AND digest=?', key)
+        conn.commit()
+        conn.close()
+
+    def clear(self, mirror, hgsid, db):
+        """
+        Forget about every upload to `hgsid` and `db`, e.g. because an upload
+        replaced some of their tracks.
+        """
+        key = (mirror, str(hgsid), db)
+        if self.filename is None:
+            with self._lock:
+                for k in [k for k in self._memory if k[:3] == key]:
+                    del self._memory[k]
+            return
+        conn = self._connect()
+        conn.execute(
+            'DELETE FROM uploads WHERE mirror=? AND hgsid=? AND db=?', key)
+        conn.commit()
+        conn.close()
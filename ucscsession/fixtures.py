@@ -0,0 +1,227 @@
+"""
+Recording and replaying HTTP responses.
+
+With settings.fixture_mode = "record", every response a session receives is
+saved as a gzipped JSON file in settings.fixture_dir, building a corpus of
+real Genome Browser pages (e.g., for parser benchmarks).  With
+settings.fixture_mode = "replay", sessions are answered from that directory
+instead of the network, so recorded workflows can be re-run offline::
+
+    from ucscsession import settings
+    settings.fixture_mode = 'record'
+    settings.fixture_dir = 'fixtures'
+    u = ucscsession.new_session(mirror='http://genome.ucsc.edu')
+    u.set_position('chr1:1-2000')
+    u.tracks
+
+Requests are identified by method, CGI path, parameters and body, ignoring
+the host and hgsid, so fixtures recorded on one mirror can be replayed
+against any mirror URL.  When the same request is made more than once (e.g.,
+hgTracks after each change to the cart), each response is recorded in order
+and replayed in the same order; requests beyond those recorded get the last
+recorded response.
+"""
+import io
+import os
+import re
+import gzip
+import json
+import base64
+import urllib
+import hashlib
+import logging
+import urlparse
+import posixpath
+import threading
+import requests
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+logger = logging.getLogger(__name__)
+
+# Headers that describe the original encoding of the body, which no longer
+# applies once it has been decoded and stored
+_DROP_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length')
+
+_BOUNDARY = re.compile(r'boundary=([^;\s]+)')
+
+
+class FixtureNotFound(Exception):
+    pass
+
+
+def request_key(request):
+    """
+    Return a filename-safe key identifying a requests.PreparedRequest.
+    """
+    parts = urlparse.urlsplit(request.url)
+    path = posixpath.normpath(parts.path)
+    query = sorted(
+        (k, v) for k, v in urlparse.parse_qsl(parts.query,
+                                              keep_blank_values=True)
+        if k != 'hgsid')
+    h = hashlib.sha1('%s %s?%s' % (request.method, path,
+                                   urllib.urlencode(query)))
+    body = request.body
+    content_type = request.headers.get('Content-Type', '')
+    if isinstance(body, basestring):
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            body = urllib.urlencode(sorted(
+                (k, v) for k, v in urlparse.parse_qsl(body,
+                                                      keep_blank_values=True)
+                if k != 'hgsid'))
+        m = _BOUNDARY.search(content_type)
+        if m:
+            # Boundaries are random, so leave them out
+            body = body.replace(m.group(1), '')
+        h.update(body)
+    elif body is not None:
+        # Streamed bodies (e.g., uploads) can't be read without consuming
+        # them, so only their type is used
+        h.update(content_type.split(';')[0])
+    return '%s_%s' % (posixpath.basename(path) or 'index', h.hexdigest()[:16])
+
+
+class FixtureStore(object):
+    """
+    Directory of recorded responses, one gzipped JSON file per response.
+
+    Use fixture_store() to get the store shared by all sessions.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._counts = {}
+        self._lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def __repr__(self):
+        return '<FixtureStore %s>' % self.directory
+
+    def _filename(self, key, n):
+        return os.path.join(self.directory, '%s.%s.json.gz' % (key, n))
+
+    def _next(self, key):
+        with self._lock:
+            n = self._counts.get(key, 0)
+            self._counts[key] = n + 1
+        return n
+
+    def rewind(self):
+        """
+        Start replaying (or recording) each request from its first response.
+        """
+        with self._lock:
+            self._counts = {}
+
+    def save(self, request, response):
+        """
+        Record `response` to `request`.
+        """
+        key = request_key(request)
+        headers = dict((k, v) for k, v in response.headers.items()
+                       if k.lower() not in _DROP_HEADERS)
+        record = dict(
+            method=request.method,
+            url=request.url,
+            status=response.status_code,
+            reason=response.reason,
+            headers=headers,
+            body=base64.b64encode(response.content))
+        fout = gzip.open(self._filename(key, self._next(key)), 'wb')
+        json.dump(record, fout)
+        fout.close()
+        logger.debug('recorded %s %s as %s'
+                     % (request.method, request.url, key))
+
+    def load(self, request):
+        """
+        Return the recorded data for `request` as a dictionary; raises
+        FixtureNotFound if it wasn't recorded.
+        """
+        key = request_key(request)
+        n = self._next(key)
+        while n >= 0:
+            fn = self._filename(key, n)
+            if os.path.exists(fn):
+                record = json.load(gzip.open(fn, 'rb'))
+                record['body'] = base64.b64decode(record['body'])
+                return record
+            n -= 1
+        raise FixtureNotFound('no fixture for %s %s (%s) in %s'
+                              % (request.method, request.url, key,
+                                 self.directory))
+
+    def records(self):
+        """
+        Yield every recorded response as a dictionary, sorted by filename.
+        """
+        for fn in sorted(os.listdir(self.directory)):
+            if fn.endswith('.json.gz'):
+                record = json.load(gzip.open(
+                    os.path.join(self.directory, fn), 'rb'))
+                record['body'] = base64.b64decode(record['body'])
+                yield record
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def fixture_store(directory):
+    """
+    Return the FixtureStore for `directory`, shared by all sessions so that
+    repeated requests are numbered consistently.
+    """
+    directory = os.path.abspath(directory)
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = FixtureStore(directory)
+        return _stores[directory]
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that saves every response it receives to `store`.
+    """
+    def __init__(self, store, **kwargs):
+        self.store = store
+        HTTPAdapter.__init__(self, **kwargs)
+
+    def send(self, request, **kwargs):
+        response = HTTPAdapter.send(self, request, **kwargs)
+        # Reading the content here means streamed responses are fully
+        # buffered, which is fine for recording.
+        self.store.save(request, response)
+        return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Transport adapter that answers requests from `store` without any network
+    access.
+    """
+    def __init__(self, store):
+        self.store = store
+        BaseAdapter.__init__(self)
+
+    def send(self, request, **kwargs):
+        record = self.store.load(request)
+        response = requests.Response()
+        response.status_code = record['status']
+        response.reason = record['reason']
+        response.headers = CaseInsensitiveDict(record['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(record['body'])
+        response._content = record['body']
+        response._content_consumed = True
+        # The current URL rather than the recorded one, so links resolve
+        # relative to the mirror being used
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,190 @@
+"""
+Lightweight model of the HTML forms on track configuration pages.
+
+Controls are parsed once into plain Python objects.  Forms keep track of
+which controls have been changed, so that submitting sends only what is
+needed.
+"""
+import parsing
+
+# Types of controls whose value is a list of selected/checked items
+_LIST_TYPES = ('select', 'checkbox', 'radio')
+
+# Controls that are never sent with a submission
+_IGNORED_TYPES = ('submit', 'button', 'image', 'reset', 'file')
+
+
+class Control(object):
+    """
+    A named form control.
+
+    For select, checkbox and radio controls, `value` is a list of the
+    selected (or checked) items out of `options`; for other controls it's
+    a string.
+    """
+    def __init__(self, name, type, value, options=None, multiple=False):
+        self.name = name
+        self.type = type
+        self.value = value
+        self.initial = value
+        self.options = options
+        self.multiple = multiple
+
+    @property
+    def changed(self):
+        return self.value != self.initial
+
+    def set(self, value):
+        if self.type not in _LIST_TYPES:
+            self.value = value
+            return
+        if isinstance(value, basestring) or not hasattr(value, '__iter__'):
+            value = [value]
+        # Options are strings, but values like 100 are meant the same way
+        value = [v if isinstance(v, basestring) else str(v) for v in value]
+        for v in value:
+            if v not in self.options:
+                raise ValueError('"%s" is not an option for %s; options are %s'
+                                 % (v, self.name, self.options))
+        if len(value) > 1 and not self.multiple:
+            raise ValueError('%s only accepts a single value' % self.name)
+        self.value = value
+
+    def __repr__(self):
+        if self.type in _LIST_TYPES:
+            items = ', '.join(
+                ('*' + i) if i in self.value else i for i in self.options)
+            value = '[%s]' % items
+        else:
+            value = self.value
+        return '<%sControl(%s=%s)>' % (self.type.capitalize(), self.name,
+                                       value)
+
+
+class Form(object):
+    """
+    A form from a configuration page.  Access control values like
+    a dictionary, e.g. form['refGene'] = 'pack'.
+    """
+    def __init__(self, action, method, controls):
+        self.action = action
+        self.method = method
+        self.controls = controls
+
+    def __repr__(self):
+        return '<Form %s %s (%s controls)>' % (self.method, self.action,
+                                               len(self.controls))
+
+    def __str__(self):
+        return '\n'.join([repr(self)] + ['  %r' % i for i in self.controls])
+
+    def __contains__(self, name):
+        return self.find_control(name) is not None
+
+    def __getitem__(self, name):
+        return self._control(name).value
+
+    def __setitem__(self, name, value):
+        self._control(name).set(value)
+
+    def find_control(self, name):
+        for control in self.controls:
+            if control.name == name:
+                return control
+
+    def _control(self, name):
+        control = self.find_control(name)
+        if control is None:
+            raise KeyError(name)
+        return control
+
+    @property
+    def changed(self):
+        """
+        Dictionary of {name: value} for controls that have been changed.
+        """
+        return dict((i.name, i.value) for i in self.controls if i.changed)
+
+    def data(self, changed_only=True, hidden=True):
+        """
+        Dictionary of the data to submit for this form.
+
+        If `changed_only` is True, this is the changed controls plus (if
+        `hidden` is True) the hidden ones that identify the track and
+        session.  UCSC uses hidden "boolshad.<name>" controls to notice
+        unchecked checkboxes, so those are only sent along with their
+        (changed) checkbox.
+        """
+        hidden_names = set(
+            i.name for i in self.controls if i.type == 'hidden')
+        d = {}
+        for control in self.controls:
+            if control.type in _IGNORED_TYPES:
+                continue
+            if changed_only:
+                if control.type == 'hidden':
+                    if not hidden or control.name.startswith('boolshad.'):
+                        continue
+                elif not control.changed:
+                    continue
+            d[control.name] = control.value
+            if 'boolshad.' + control.name in hidden_names:
+                d['boolshad.' + control.name] = \
+                    self['boolshad.' + control.name]
+        return d
+
+
+def forms_from_response(response):
+    """
+    Return a list of Form objects for all forms in `response`.
+    """
+    return [_form(i) for i in parsing.soup(response)('form')]
+
+
+def _option_value(option):
+    value = option.get('value')
+    if value is None:
+        # Options are often left unclosed, so only use the option's own text
+        value = option.find(text=True, recursive=False) or ''
+    return value.strip()
+
+
+def _form(form):
+    controls = []
+    radios = {}
+    for tag in form(['input', 'select', 'textarea']):
+        name = tag.get('name')
+        if not name:
+            continue
+        if tag.name == 'select':
+            options = tag('option')
+            values = [_option_value(i) for i in options]
+            selected = [_option_value(i) for i in options
+                        if i.has_attr('selected')]
+            multiple = tag.has_attr('multiple')
+            if not selected and values and not multiple:
+                selected = values[:1]
+            controls.append(
+                Control(name, 'select', selected, values, multiple))
+        elif tag.name == 'textarea':
+            controls.append(Control(name, 'textarea', tag.text))
+        else:
+            type_ = tag.get('type', 'text').lower()
+            value = tag.get('value', '')
+            if type_ == 'checkbox':
+                value = tag.get('value', 'on')
+                checked = [value] if tag.has_attr('checked') else []
+                controls.append(
+                    Control(name, 'checkbox', checked, [value]))
+            elif type_ == 'radio':
+                if name not in radios:
+                    radios[name] = Control(name, 'radio', [], [])
+                    controls.append(radios[name])
+                radio = radios[name]
+                radio.options.append(value)
+                if tag.has_attr('checked'):
+                    radio.value = radio.initial = [value]
+            else:
+                controls.append(Control(name, type_, value))
+    return Form(form.get('action'), form.get('method', 'GET').upper(),
+                controls)
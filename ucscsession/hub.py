@@ -0,0 +1,269 @@
+"""
+Track hubs for large datasets.
+
+Rather than uploading large custom tracks as text, they can be converted
+locally into indexed binary formats (bigBed and bigWig) and described in
+a track hub.  Once the hub is connected (see _UCSCSession.connect_hub), the
+Genome Browser only fetches the byte ranges it needs to draw the current view.
+
+Conversion uses the UCSC command-line tools ``bedToBigBed`` and
+``bedGraphToBigWig``, which must be on the PATH.  The hub directory must be
+served from a URL that the Genome Browser can reach; serve() runs a simple
+server supporting HTTP range requests, which is useful for testing against
+a local mirror.
+"""
+import os
+import re
+import shutil
+import logging
+import threading
+import subprocess
+import SocketServer
+import SimpleHTTPServer
+
+logger = logging.getLogger(__name__)
+
+_BEDGRAPH_EXTENSIONS = ('.bedgraph', '.bg', '.bdg')
+
+
+class HubTrack(object):
+    """
+    A track in a TrackHub.  `source` is a BED or bedGraph filename or
+    pybedtools.BedTool; `kind` is "bigBed" or "bigWig" (by default, guessed
+    from the filename).  Any other keyword arguments are added as trackDb
+    settings (e.g., color="255,0,0").
+    """
+    def __init__(self, source, name, kind=None, short_label=None,
+                 long_label=None, visibility='dense', **settings):
+        self.source = source
+        self.name = name
+        if kind is None:
+            kind = 'bigBed'
+            fn = getattr(source, 'fn', source)
+            if isinstance(fn, basestring) \
+                    and fn.lower().endswith(_BEDGRAPH_EXTENSIONS):
+                kind = 'bigWig'
+        if kind not in ('bigBed', 'bigWig'):
+            raise ValueError('kind must be "bigBed" or "bigWig"')
+        self.kind = kind
+        self.short_label = short_label or name
+        self.long_label = long_label or self.short_label
+        self.visibility = visibility
+        self.settings = settings
+        self.type = kind
+
+    def __repr__(self):
+        return '<HubTrack "%s" (%s)>' % (self.name, self.kind)
+
+    @property
+    def filename(self):
+        if self.kind == 'bigBed':
+            return self.name + '.bb'
+        return self.name + '.bw'
+
+    def convert(self, chromsizes, outdir):
+        """
+        Write the indexed binary file for this track into `outdir`.
+        """
+        import pybedtools
+        source = self.source
+        if not isinstance(source, pybedtools.BedTool):
+            source = pybedtools.BedTool(source)
+
+        # Both tools need sorted input without track or browser lines.
+        sorted_fn = source.filter(lambda f: True).sort().fn
+        out = os.path.join(outdir, self.filename)
+        if self.kind == 'bigBed':
+            n = _field_count(sorted_fn)
+            cmds = ['bedToBigBed']
+            if n > 12:
+                cmds.append('-type=bed12+%s' % (n - 12))
+            self.type = 'bigBed %s' % min(n, 12)
+            cmds += [sorted_fn, chromsizes, out]
+        else:
+            cmds = ['bedGraphToBigWig', sorted_fn, chromsizes, out]
+        logger.debug(' '.join(cmds))
+        subprocess.check_call(cmds)
+        return out
+
+    def trackdb(self):
+        lines = [
+            'track %s' % self.name,
+            'bigDataUrl %s' % self.filename,
+            'shortLabel %s' % self.short_label,
+            'longLabel %s' % self.long_label,
+            'type %s' % self.type,
+            'visibility %s' % self.visibility,
+        ]
+        lines += ['%s %s' % (k, v) for k, v in sorted(self.settings.items())]
+        return '\n'.join(lines) + '\n'
+
+
+def _field_count(fn):
+    for line in open(fn):
+        if line.strip():
+            return len(line.rstrip('\n').split('\t'))
+    return 3
+
+
+class TrackHub(object):
+    """
+    A track hub directory for a single genome.
+
+    Usage::
+
+        hub = TrackHub('myhub', genome='hg19', email='me@example.com')
+        hub.add_track('peaks.bed', 'peaks')
+        hub.add_track('signal.bedgraph', 'signal', color='0,0,255')
+        hub.write(chromsizes='hg19.chrom.sizes')
+        u.connect_hub('http://example.com/myhub/hub.txt')
+    """
+    def __init__(self, outdir, genome, name='ucscsession', short_label=None,
+                 long_label=None, email=''):
+        if not re.match(r'^[\w.-]+$', name):
+            raise ValueError('hub name may only contain letters, digits, '
+                             '"_", "." and "-"')
+        self.outdir = outdir
+        self.genome = genome
+        self.name = name
+        self.short_label = short_label or name
+        self.long_label = long_label or self.short_label
+        self.email = email
+        self.tracks = []
+
+    def __repr__(self):
+        return '<TrackHub "%s" (%s, %s tracks)>' % (self.name, self.genome,
+                                                    len(self.tracks))
+
+    def add_track(self, source, name, **kwargs):
+        """
+        Add a track; see HubTrack for arguments.  Returns the HubTrack.
+        """
+        track = HubTrack(source, name, **kwargs)
+        self.tracks.append(track)
+        return track
+
+    @property
+    def hub_txt(self):
+        return os.path.join(self.outdir, 'hub.txt')
+
+    def write(self, chromsizes=None):
+        """
+        Convert all tracks and write hub.txt, genomes.txt and trackDb.txt.
+
+        `chromsizes` is a chromsizes filename; by default the sizes are
+        looked up with pybedtools.  Returns the path to hub.txt.
+        """
+        genome_dir = os.path.join(self.outdir, self.genome)
+        if not os.path.exists(genome_dir):
+            os.makedirs(genome_dir)
+        if chromsizes is None:
+            import pybedtools
+            chromsizes = os.path.join(self.outdir, self.genome + '.chrom.sizes')
+            pybedtools.chromsizes_to_file(
+                pybedtools.chromsizes(self.genome), chromsizes)
+
+        for track in self.tracks:
+            track.convert(chromsizes, genome_dir)
+
+        fout = open(self.hub_txt, 'w')
+        fout.write('hub %s\nshortLabel %s\nlongLabel %s\n'
+                   'genomesFile genomes.txt\nemail %s\n'
+                   % (self.name, self.short_label, self.long_label,
+                      self.email))
+        fout.close()
+        fout = open(os.path.join(self.outdir, 'genomes.txt'), 'w')
+        fout.write('genome %s\ntrackDb %s/trackDb.txt\n'
+                   % (self.genome, self.genome))
+        fout.close()
+        fout = open(os.path.join(genome_dir, 'trackDb.txt'), 'w')
+        fout.write('\n'.join(i.trackdb() for i in self.tracks))
+        fout.close()
+        return self.hub_txt
+
+
+class RangeRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """
+    Static file handler that also supports single-range requests
+    ("Range: bytes=start-end"), as the Genome Browser uses for bigBed and
+    bigWig files.
+    """
+    _RANGE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+    def send_head(self):
+        m = self._RANGE.match(self.headers.get('Range', '').strip())
+        path = self.translate_path(self.path)
+        if m is None or not os.path.isfile(path):
+            return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+        size = os.path.getsize(path)
+        start, end = m.groups()
+        if start:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        else:
+            start = max(size - int(end or 0), 0)
+            end = size - 1
+        if start >= size or start > end:
+            self.send_error(416, 'Requested range not satisfiable')
+            return None
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Range', 'bytes %s-%s/%s' % (start, end, size))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self._remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, '_remaining', None)
+        if remaining is None:
+            return shutil.copyfileobj(source, outputfile)
+        while remaining > 0:
+            chunk = source.read(min(65536, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+        self._remaining = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class _ThreadingServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(directory, host='127.0.0.1', port=0):
+    """
+    Serve `directory` over HTTP (with range request support) in
+    a background thread.
+
+    By default only this machine can connect.  Everything in `directory` is
+    readable, including directory listings, so only use host='0.0.0.0' (for
+    a mirror on another machine) on a trusted network.
+
+    Returns the server; its `url` attribute is the base URL, and calling its
+    shutdown() method stops it.
+    """
+    directory = os.path.abspath(directory)
+
+    class Handler(RangeRequestHandler):
+        def translate_path(self, path):
+            # Serve relative to `directory` rather than the current directory
+            path = SimpleHTTPServer.SimpleHTTPRequestHandler.translate_path(
+                self, path)
+            return os.path.join(directory, os.path.relpath(path, os.getcwd()))
+
+    server = _ThreadingServer((host, port), Handler)
+    server.url = 'http://%s:%s' % (host if host != '0.0.0.0' else 'localhost',
+                                   server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.info('serving %s at %s' % (directory, server.url))
+    return server
@@ -0,0 +1,304 @@
+"""
+Instrumentation of the requests, waits and parsing done by sessions.
+
+Metrics are off by default.  To collect them for a session, set its
+`metrics` attribute to a Metrics object (or set settings.metrics to have all
+new sessions share one)::
+
+    from ucscsession.metrics import Metrics
+    u.metrics = Metrics()
+    u.pdf('chr1:1-2000', filename='view.pdf')
+    print u.metrics.prometheus()
+
+When a session's `metrics` is None, the only cost is an attribute check per
+request, wait and parse.
+"""
+import json
+import zlib
+import time
+import bisect
+import urlparse
+import posixpath
+import threading
+
+# Upper bounds of histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+           float('inf'))
+
+# Size of reads when counting the bytes of a response body
+CHUNK_SIZE = 64 * 1024
+
+
+class Histogram(object):
+    """
+    Counts of observed values in buckets with the upper bounds `buckets`,
+    along with their sum.
+    """
+    __slots__ = ['buckets', 'counts', 'count', 'sum']
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def __repr__(self):
+        return '<Histogram count=%s sum=%.3f>' % (self.count, self.sum)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        List of (upper bound, number of values <= upper bound).
+        """
+        total = 0
+        result = []
+        for bound, n in zip(self.buckets, self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+    def as_dict(self):
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            buckets=[['+Inf' if b == float('inf') else b, n]
+                     for b, n in self.cumulative()])
+
+
+class EndpointStats(object):
+    """
+    Requests made to a single CGI.  `errors` counts HTTP 4xx and 5xx
+    responses; `sent` and `received` are bytes of request and response
+    bodies (as sent over the wire, i.e. compressed if they were, but without
+    chunked transfer encoding framing).  Streamed responses without a
+    Content-Length are counted as 0 bytes received, since their bodies are
+    read after they are recorded.
+    """
+    __slots__ = ['count', 'errors', 'sent', 'received', 'latency']
+
+    def __init__(self, buckets=BUCKETS):
+        self.count = 0
+        self.errors = 0
+        self.sent = 0
+        self.received = 0
+        self.latency = Histogram(buckets)
+
+    def as_dict(self):
+        return dict(count=self.count, errors=self.errors, sent=self.sent,
+                    received=self.received, latency=self.latency.as_dict())
+
+
+def endpoint(url):
+    """
+    Name of the CGI for `url` (e.g., "hgTracks"), or "trash" for files in the
+    server's trash directory like rendered PDFs.
+    """
+    path = posixpath.normpath(urlparse.urlsplit(url).path)
+    if '/trash/' in path:
+        return 'trash'
+    return posixpath.basename(path)
+
+
+def _received_size(response):
+    """
+    Read the body of `response` and return its size as received.
+
+    requests would decode a gzipped body as it reads it, and urllib3 doesn't
+    count the bytes of chunked bodies it reads -- so the body is read
+    undecoded, counted, and gunzipped here instead.  Bodies with other
+    encodings, or that have already been read (e.g., replayed ones), are
+    counted after decoding.
+    """
+    encoding = response.headers.get('Content-Encoding', 'identity').lower()
+    if ((response._content is not False) or
+            (encoding not in ('gzip', 'identity')) or
+            not hasattr(response.raw, 'stream')):
+        return len(response.content)
+    received = 0
+    chunks = []
+    decompressor = None
+    if encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+        received += len(chunk)
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        chunks.append(chunk)
+    if decompressor is not None:
+        chunks.append(decompressor.flush())
+    response._content = ''.join(chunks)
+    response._content_consumed = True
+    return received
+
+
+def _body_size(body):
+    if body is None:
+        return 0
+    if isinstance(body, basestring):
+        return len(body)
+    # Streamed bodies like ucscsession.upload.MultipartStream
+    return getattr(body, 'bytes_read', 0)
+
+
+class Metrics(object):
+    """
+    Thread-safe collection of per-endpoint request counts, latencies and
+    bytes, time spent sleeping (e.g., while polling for PDFs) and time spent
+    parsing HTML.
+
+    Each of `callbacks` is called with a dictionary describing every event as
+    it is recorded, e.g. {'kind': 'request', 'name': 'hgTracks',
+    'seconds': 0.31, 'status': 200, 'sent': 0, 'received': 48213}; 'kind' is
+    one of 'request', 'sleep' or 'parse'.
+    """
+    def __init__(self, buckets=BUCKETS, callbacks=None):
+        self.buckets = buckets
+        self.callbacks = list(callbacks or [])
+        self._lock = threading.Lock()
+        self.reset()
+
+    def __repr__(self):
+        return '<Metrics (%s requests)>' % sum(
+            i.count for i in self.requests.values())
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}
+            self.sleep = {}
+            self.parse = {}
+            self.started = time.time()
+
+    def _notify(self, event):
+        for callback in self.callbacks:
+            callback(event)
+
+    def record_response(self, response, stream=False):
+        """
+        Record a requests.Response.  Latency is the time until the response
+        headers were received.  Unless the response is being streamed, its
+        body is read if needed to count its (possibly compressed) size on
+        the wire.
+        """
+        request = response.request
+        name = endpoint(request.url)
+        seconds = response.elapsed.total_seconds()
+        sent = _body_size(request.body)
+        received = response.headers.get('Content-Length')
+        if received is not None:
+            received = int(received)
+        elif not stream:
+            received = _received_size(response)
+        else:
+            received = 0
+        with self._lock:
+            stats = self.requests.get(name)
+            if stats is None:
+                stats = self.requests[name] = EndpointStats(self.buckets)
+            stats.count += 1
+            stats.errors += response.status_code >= 400
+            stats.sent += sent
+            stats.received += received
+            stats.latency.observe(seconds)
+        if self.callbacks:
+            self._notify(dict(kind='request', name=name, seconds=seconds,
+                              status=response.status_code, sent=sent,
+                              received=received))
+
+    def _observe(self, kind, table, name, seconds):
+        with self._lock:
+            h = table.get(name)
+            if h is None:
+                h = table[name] = Histogram(self.buckets)
+            h.observe(seconds)
+        if self.callbacks:
+            self._notify(dict(kind=kind, name=name, seconds=seconds))
+
+    def record_sleep(self, reason, seconds):
+        self._observe('sleep', self.sleep, reason, seconds)
+
+    def record_parse(self, parser, seconds):
+        self._observe('parse', self.parse, parser, seconds)
+
+    def as_dict(self):
+        """
+        All metrics as a JSON-serializable dictionary.
+        """
+        with self._lock:
+            return dict(
+                started=self.started,
+                elapsed=time.time() - self.started,
+                requests=dict((k, v.as_dict())
+                              for k, v in self.requests.items()),
+                sleep=dict((k, v.as_dict()) for k, v in self.sleep.items()),
+                parse=dict((k, v.as_dict()) for k, v in self.parse.items()))
+
+    def to_json(self, filename=None):
+        """
+        Return the metrics as a JSON string, also writing it to `filename` if
+        given.
+        """
+        s = json.dumps(self.as_dict(), indent=2, sort_keys=True)
+        if filename is not None:
+            fout = open(filename, 'w')
+            fout.write(s)
+            fout.close()
+        return s
+
+    def prometheus(self, prefix='ucscsession'):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def metric(name, type_, help, samples):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, type_))
+            for suffix, labels, value in samples:
+                labels = ','.join('%s="%s"' % i for i in labels)
+                lines.append('%s_%s%s{%s} %s' % (prefix, name, suffix, labels,
+                                                 _number(value)))
+
+        def histogram(name, help, label, table):
+            samples = []
+            for key, h in sorted(table.items()):
+                for bound, n in h.cumulative():
+                    samples.append(
+                        ('_bucket', [(label, key), ('le', _number(bound))], n))
+                samples.append(('_sum', [(label, key)], h.sum))
+                samples.append(('_count', [(label, key)], h.count))
+            metric(name, 'histogram', help, samples)
+
+        with self._lock:
+            requests = sorted(self.requests.items())
+            for name, attr, help in [
+                    ('requests_total', 'count',
+                     'Requests to each Genome Browser CGI.'),
+                    ('request_errors_total', 'errors',
+                     'HTTP 4xx and 5xx responses from each CGI.'),
+                    ('request_sent_bytes_total', 'sent',
+                     'Bytes of request bodies sent to each CGI.'),
+                    ('request_received_bytes_total', 'received',
+                     'Bytes of response bodies received from each CGI.')]:
+                metric(name, 'counter', help,
+                       [('', [('endpoint', k)], getattr(v, attr))
+                        for k, v in requests])
+            histogram('request_duration_seconds',
+                      'Time until response headers were received.',
+                      'endpoint',
+                      dict((k, v.latency) for k, v in requests))
+            histogram('sleep_seconds',
+                      'Time spent sleeping, e.g. while waiting for PDFs.',
+                      'reason', self.sleep)
+            histogram('parse_seconds', 'Time spent parsing HTML.',
+                      'parser', self.parse)
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value)
@@ -0,0 +1,124 @@
+"""
+Shared HTML parsing for responses from the Genome Browser.
+
+Each response is parsed at most once; the parsed document is cached on the
+response object so that all of the extractors below can share it.  If lxml is
+installed it is used as the (much faster) underlying parser, otherwise the
+parser built into Python is used.  BeautifulSoup and lxml are only imported
+when the first document is parsed.
+"""
+import os
+import re
+from HTMLParser import HTMLParser
+
+# Parser used by BeautifulSoup; if None, it's chosen on the first parse
+PARSER = None
+
+_CACHE_ATTR = '_ucscsession_soup'
+
+_P = re.compile(r'<p\b[^>]*>(.*?)(?=<p\b|</p\s*>|</body|$)', re.I | re.S)
+_ERROR_SPAN = re.compile(
+    r'<[sS][pP][aA][nN]\b[^>]*>Error</[sS][pP][aA][nN]\s*>')
+_TAG = re.compile(r'<[^>]*>')
+_DB = re.compile(
+    r"""<input\b[^>]*\bname=["']?db["']?\s+value=["']?([^"'\s>]+)""", re.I)
+_HGSID = re.compile(
+    r"""\bhgsid(?:["']?\s+value=["']?|=)(\w+)""", re.I)
+_unescape = HTMLParser().unescape
+
+
+def soup(response):
+    """
+    Return the parsed document for `response`, parsing it only the first
+    time.
+    """
+    global PARSER
+    b = getattr(response, _CACHE_ATTR, None)
+    if b is None:
+        from bs4 import BeautifulSoup
+        if PARSER is None:
+            try:
+                import lxml
+                PARSER = 'lxml'
+            except ImportError:
+                PARSER = 'html.parser'
+        b = BeautifulSoup(response.text, PARSER)
+        setattr(response, _CACHE_ATTR, b)
+    return b
+
+
+def hgsid(response):
+    """
+    Return the single hgsid found in the hidden inputs of `response`.
+    """
+    values = set(
+        i.get('value')
+        for i in soup(response)('input', attrs={'name': 'hgsid'}))
+    assert len(values) == 1
+    return list(values)[0]
+
+
+def hgsids(response):
+    """
+    Return the set of hgsids in the hidden inputs and links of `response`,
+    found without parsing the whole document.
+    """
+    return set(_HGSID.findall(response.text))
+
+
+def db(text):
+    """
+    Return the assembly in the hidden "db" input of hgTracks page `text`,
+    or None if there isn't one.
+    """
+    m = _DB.search(text)
+    if m:
+        return m.group(1)
+
+
+def pdf_link(response):
+    """
+    Return the absolute URL of the rendered PDF linked from `response`, or
+    None if there isn't one.
+    """
+    for a in soup(response)('a', href=True):
+        fn = a['href']
+        if ('hgt_genome_' in fn) and (fn.endswith('.pdf')):
+            return os.path.join(os.path.dirname(response.url), fn)
+
+
+def cart(response):
+    """
+    Return a dictionary of the cart variables in a cartDump response.
+    """
+    d = {}
+    for i in soup(response).pre.text.splitlines(False):
+        items = i.split(None, 1)
+        if len(items) == 1:
+            k, v = items[0], None
+        else:
+            k, v = items
+        d[k] = v
+    return d
+
+
+def track_cells(response):
+    """
+    Return all <td> tags of an hgTracks response.
+    """
+    return soup(response)('td')
+
+
+def errors(response):
+    """
+    Return the text of each <p> that contains an "Error" <span>, which is how
+    hgCustom reports problems with uploaded files.
+
+    hgCustom pages can be large, so rather than parsing the whole document
+    this only looks at paragraphs, and only if "Error" appears at all.
+    """
+    text = response.text
+    if 'Error' not in text:
+        return []
+    return [_unescape(_TAG.sub('', p)) for p in _P.findall(text)
+            if _ERROR_SPAN.search(p)]
@@ -0,0 +1,92 @@
+"""
+Readiness polling for resources (like rendered PDFs) that the server makes
+available some time after the request that creates them.
+"""
+import time
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PollTimeout(Exception):
+    pass
+
+
+class PollPolicy(object):
+    """
+    Describes how to wait for a resource to become available.
+
+    The first retry happens after `initial` seconds; each subsequent delay is
+    multiplied by `factor` up to a maximum of `max_delay`.  Each delay is
+    randomly adjusted by up to +/- `jitter` (a fraction of the delay) so that
+    many concurrent pollers don't hit the server in lockstep.  Polling gives
+    up once `deadline` seconds have passed since the first attempt.
+    """
+    def __init__(self, initial=0.05, factor=2.0, max_delay=2.0, jitter=0.1,
+                 deadline=60):
+        self.initial = initial
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.deadline = deadline
+
+    def __repr__(self):
+        return ('<PollPolicy initial=%s factor=%s max_delay=%s jitter=%s '
+                'deadline=%s>' % (self.initial, self.factor, self.max_delay,
+                                  self.jitter, self.deadline))
+
+    def delays(self):
+        """
+        Generate successive delays, stopping when the deadline would be
+        exceeded.
+        """
+        stop = time.time() + self.deadline
+        delay = self.initial
+        while True:
+            d = delay * (1 + random.uniform(-self.jitter, self.jitter))
+            if time.time() + d > stop:
+                return
+            yield d
+            delay = min(delay * self.factor, self.max_delay)
+
+    def poll(self, probe, description='resource', sleep=time.sleep):
+        """
+        Call `probe()` until it returns something other than None, sleeping
+        between attempts (by calling `sleep(seconds)`) according to this
+        policy.
+
+        Returns the first non-None result; raises PollTimeout if the deadline
+        passes first.
+        """
+        result = probe()
+        if result is not None:
+            return result
+        attempts = 1
+        for delay in self.delays():
+            sleep(delay)
+            attempts += 1
+            result = probe()
+            if result is not None:
+                logger.debug('%s ready after %s attempts'
+                             % (description, attempts))
+                return result
+        raise PollTimeout('%s not available after %s attempts (%ss)'
+                          % (description, attempts, self.deadline))
+
+
+def probe_url(session, url, **kwargs):
+    """
+    Return a function suitable for PollPolicy.poll() that GETs `url` with
+    `session` and returns the response once it is successful.
+
+    Extra kwargs (e.g., stream=True) are passed to session.get().  Failed
+    responses are closed so their connections go back to the pool.
+    """
+    def probe():
+        response = session.get(url, **kwargs)
+        if response.status_code == 200:
+            return response
+        logger.debug('%s not ready (HTTP %s)' % (url, response.status_code))
+        response.close()
+    return probe
@@ -0,0 +1,180 @@
+"""
+Thread-safe pool of independent sessions.
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from session import new_session
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class SessionPool(object):
+    """
+    Creates, leases and re-uses independent sessions (see new_session()), so
+    that concurrent threads -- e.g., request handlers in a web service --
+    each get their own hgsid, connections and cart.
+
+    At most `max_size` sessions exist at once; acquire() blocks when they are
+    all leased.  Sessions that have been idle for longer than `idle_timeout`
+    seconds are discarded.  `factory` is called with no arguments to create
+    a session; by default it creates independent sessions on `mirror`.
+
+    Typical usage::
+
+        pool = SessionPool(max_size=8)
+        pool.warm(4)
+        with pool.lease() as u:
+            u.pdf('chr1:1-2000', filename='view.pdf')
+    """
+    def __init__(self, max_size=10, idle_timeout=600, mirror=None,
+                 factory=None):
+        if factory is None:
+            factory = lambda: new_session(mirror)
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = []
+        self._leased = 0
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return '<SessionPool %s idle, %s leased, max %s>' \
+            % (len(self._idle), self._leased, self.max_size)
+
+    @property
+    def size(self):
+        """
+        Number of sessions currently in the pool, idle or leased.
+        """
+        with self._cond:
+            return len(self._idle) + self._leased
+
+    def acquire(self, timeout=None):
+        """
+        Lease a session, creating one if none are idle and the pool isn't
+        full.  If the pool is full, wait up to `timeout` seconds (or forever
+        if None) for one to be released, then raise PoolTimeout.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._cond:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    session = self._idle.pop()[0]
+                    self._leased += 1
+                    return session
+                if self._leased < self.max_size:
+                    self._leased += 1
+                    break
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            'no session available after %ss' % timeout)
+                    self._cond.wait(remaining)
+
+        # Create outside the lock so other threads aren't blocked meanwhile
+        try:
+            return self.factory()
+        except Exception:
+            with self._cond:
+                self._leased -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, session, discard=False):
+        """
+        Return a leased session to the pool, or discard it if `discard` is
+        True (e.g., if it may be in an unexpected state).
+        """
+        with self._cond:
+            self._leased -= 1
+            if discard:
+                _close(session)
+            else:
+                self._idle.append((session, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """
+        Context manager that acquires a session and releases it afterwards.
+        If the block raises an exception, the session is discarded rather
+        than returned to the pool, since it may be in an unexpected state.
+        """
+        session = self.acquire(timeout=timeout)
+        try:
+            yield session
+        except BaseException:
+            self.release(session, discard=True)
+            raise
+        self.release(session)
+
+    def warm(self, n):
+        """
+        Pre-create up to `n` idle sessions (respecting max_size), including
+        their hgsids, so that later leases don't wait on the network.
+        """
+        created = []
+        with self._cond:
+            n = max(min(n, self.max_size - len(self._idle) - self._leased),
+                    0)
+            self._leased += n
+        try:
+            for i in range(n):
+                session = self.factory()
+                session.session
+                created.append(session)
+        finally:
+            with self._cond:
+                self._leased -= n
+                now = time.time()
+                self._idle.extend((s, now) for s in created)
+                self._cond.notify_all()
+        logger.debug('warmed %s sessions' % len(created))
+        return len(created)
+
+    def evict_idle(self):
+        """
+        Discard sessions that have been idle longer than idle_timeout.
+        """
+        with self._cond:
+            self._evict_idle()
+
+    def _evict_idle(self):
+        cutoff = time.time() - self.idle_timeout
+        keep = []
+        for session, last_used in self._idle:
+            if last_used < cutoff:
+                _close(session)
+            else:
+                keep.append((session, last_used))
+        if len(keep) != len(self._idle):
+            logger.debug('evicted %s idle sessions'
+                         % (len(self._idle) - len(keep)))
+            self._cond.notify_all()
+        self._idle = keep
+
+    def close(self):
+        """
+        Discard all idle sessions.
+        """
+        with self._cond:
+            for session, last_used in self._idle:
+                _close(session)
+            self._idle = []
+
+
+def _close(session):
+    if getattr(session, '_session', None) is not None:
+        session._session.close()
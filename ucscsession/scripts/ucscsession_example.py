@@ -14,11 +14,13 @@ u = UCSCSession()
 
 
 # -----------------------------------------------------------------------------
-# Upload custom tracks using example data from pybedtools.
+# Upload custom tracks using example data from pybedtools.  Tracks are uploaded
+# concurrently, and the results report any that failed.
+tracks = []
 for fn in ['a.bed', 'b.bed']:
-    x = pybedtools.example_bedtool(fn)\
-        .saveas(trackline='track name=%s' % fn)
-    response = u.upload_track(x)
+    tracks.append((pybedtools.example_bedtool(fn), 'track name=%s' % fn))
+results = u.upload_tracks(tracks)
+results.raise_for_errors()
 
 
 # -----------------------------------------------------------------------------
@@ -71,7 +73,7 @@ t = u.tracks['refGene']
 # -----------------------------------------------------------------------------
 # Track.config represents a configuration page for a track.  There can be one
 # or more forms on this page, and each form on the configuration page is
-# represented as a mechanize.HTMLForm.
+# represented as a ucscsession.forms.Form.
 #
 # It so happens that the refGene track only has a single form.
 form = t.config.forms[0]
@@ -1,16 +1,22 @@
 import time
-import pybedtools
-import webbrowser
-import requests
 import os
-from bs4 import BeautifulSoup
+import json
 import helpers
+import parsing
+import transport
+import upload
 import logging
 import getpass
-from tracks import tracks_from_response
+import threading
+from contextlib import contextmanager
+from tracks import iter_track_records, update_tracks, controls_digest
+from batch import run_batch
+from polling import PollPolicy, probe_url
+from catalog import TrackCatalog
+from cart import Cart
+from dedup import UploadIndex
 
 # maintain different loggers for different functionality.
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 hgsid_logger = logging.getLogger(__name__ + '(hgsid)')
 hgsid_logger.setLevel(logging.DEBUG)
@@ -36,17 +42,109 @@ def UCSCSession():
     return _ucsc_session_instance[0]
 
 
+def new_session(mirror=None, hgsid=None):
+    """
+    Create a new, independent session in the UCSC Genome Browser.
+
+    Unlike UCSCSession(), each call returns a new object with its own mirror
+    (by default, the current settings.mirror), hgsid, connections and cart,
+    so several can be used at the same time (e.g., from different threads).
+    Provide `hgsid` to resume an existing session on the server.
+    """
+    if mirror is None:
+        mirror = settings.mirror
+    return _UCSCSession(mirror=mirror, hgsid=hgsid)
+
+
+def from_state(filename):
+    """
+    Create a new, independent session from a snapshot written by
+    _UCSCSession.save_state(), without making any requests.
+
+    This lets short-lived worker processes start from a session that has
+    already been set up (e.g., with tracks uploaded and configured) rather
+    than paying for a new hgsid and a cart fetch each time.
+    """
+    state = json.load(open(filename))
+    u = _UCSCSession(mirror=state['mirror'], hgsid=state['hgsid'])
+    if state.get('cart') is not None:
+        u.cart.restore(state['cart'])
+    return u
+
+
+def fan_out(func, items, workers=16, mirror=None):
+    """
+    Call `func(session, item)` for each of `items`, each with its own new
+    independent session, using `workers` threads.
+
+    For example, to save a PDF of the same region with a different custom
+    track for each sample::
+
+        def render(u, sample):
+            u.upload_track(sample + '.bed')
+            return u.pdf('chr1:1-2000', filename=sample + '.pdf')
+
+        results = fan_out(render, samples, workers=32)
+
+    Returns a ucscsession.batch.BatchResults list in the same order as
+    `items`.
+    """
+    return run_batch(
+        lambda item: func(new_session(mirror), item), items, workers=workers)
+
+
 class _UCSCSession(object):
 
+    # Seconds to pause after opening a web browser in show(), so the browser
+    # has a chance to load the view before subsequent calls change it.
     _SLEEP = 2
 
-    def __init__(self):
+    def __init__(self, mirror=None, hgsid=None):
+        """
+        With no arguments (as used by UCSCSession()), the session follows
+        settings.mirror and shares settings.hgsid.  Otherwise the session is
+        independent and keeps its own mirror and hgsid; see new_session().
+        """
+        self._shared = (mirror is None) and (hgsid is None)
+        self._own_mirror = mirror
+        self._own_hgsid = hgsid
         self._session = None
+        # Guards lazy setup of self._session and the hgsid, which may first
+        # happen in several threads at once (e.g., in pdf_batch)
+        self._session_lock = threading.RLock()
         self._tracks = None
-        self._mirror = settings.mirror
-        self.cart = self.cart_info()
+        self._tracks_digest = None
+
+        # Text of the most recent hgTracks page, not yet parsed into
+        # self._tracks; and whether a fresh page needs to be fetched.
+        self._tracks_pending = None
+        self._tracks_stale = True
+
+        # Persistent cache of track catalogs, if enabled
+        self.catalog = None
+        if settings.catalog_filename is not None:
+            self.catalog = TrackCatalog(
+                settings.catalog_filename, ttl=settings.catalog_ttl)
+        # Index of already-uploaded tracks, if enabled
+        self.upload_index = None
+        if settings.dedup_uploads:
+            self.upload_index = UploadIndex(settings.upload_index_filename)
+        self._upload_lock = threading.Lock()
+
+        self._mirror = self.mirror
+        self.cart = Cart(self.cart_info, pending=lambda: self._batch or {})
+
+        # Cart variables waiting to be sent, while in a batch() block
+        self._batch = None
         self.autoraise = True
 
+        # How to wait for server-side resources like rendered PDFs
+        self.poll_policy = PollPolicy()
+
+        # A ucscsession.metrics.Metrics object to record requests, sleeps and
+        # parsing in, or None
+        self.metrics = settings.metrics
+
     def update_cart(self, **kwargs):
         """
         Update the current settings.
@@ -55,10 +153,124 @@ class _UCSCSession(object):
 
         update_cart(db="dm3")
 
+        The changes are also recorded in self.cart, so reading them back
+        doesn't need another request.
+
+        Inside a batch() block, nothing is sent and None is returned.
         """
+        self.cart.set_local(**kwargs)
+        if kwargs.get('db') is not None:
+            # Tracks differ between assemblies, so start a new table (which
+            # may come from the catalog)
+            self._tracks = None
+            self._tracks_digest = None
+            self._reset_tracks()
+        if self._batch is not None:
+            self._batch.update(
+                (k, v) for k, v in kwargs.items() if v is not None)
+            return None
         response = self.session.get(self.cart_url, data=kwargs)
         return response
 
+    @contextmanager
+    def batch(self):
+        """
+        Context manager that gathers cart changes and sends them together.
+
+        Within the block, update_cart(), set_genome(), set_position() and
+        set_track_visibilities() don't make any requests (and return None).
+        The gathered changes are sent along with the next request that
+        renders a view (show(), pdf(), zoom_in(), zoom_out(),
+        request_tracks()), or in a single hgTracks request when the block
+        exits.  For example, this makes a single request::
+
+            with u.batch():
+                u.set_genome('hg19')
+                u.set_position('chr1:1-2000')
+                u.set_track_visibilities([('refGene', 'pack')])
+                u.show()
+
+        Track visibilities are validated against the tracks known when they
+        are set.  If the block raises an exception (or sending the changes
+        fails), pending changes are discarded.  Nested blocks join the
+        outermost one.
+        """
+        if self._batch is not None:
+            yield self
+            return
+        self._batch = {}
+        try:
+            yield self
+            self.flush()
+        except Exception:
+            self.cart.invalidate()
+            raise
+        finally:
+            self._batch = None
+
+    def flush(self):
+        """
+        Send any cart changes gathered in a batch() block with one hgTracks
+        request, and return the response (or None if nothing was pending).
+        """
+        if self._batch:
+            return self.request_tracks()
+
+    def _take_pending(self):
+        """
+        Return, and forget, the cart changes gathered in a batch() block.
+        """
+        if not self._batch:
+            return {}
+        data = self._batch
+        self._batch = {}
+        return data
+
+    def save_state(self, filename):
+        """
+        Save the mirror, hgsid and cart of this session to JSON file
+        `filename`, so that it can be resumed with
+        ucscsession.from_state() or restore_state().
+
+        Any changes pending in a batch() block are sent first, and the
+        cart is fetched if it isn't already known.  The file is replaced
+        atomically, so processes reading it never see a partial snapshot.
+        """
+        self.flush()
+        cart = self.cart.snapshot()
+        if cart is None:
+            cart = self.cart.sync().snapshot()
+        state = dict(
+            mirror=self.mirror,
+            hgsid=self.hgsid,
+            cart=cart,
+            saved=time.time())
+        tmp = '%s.%s.tmp' % (filename, os.getpid())
+        fout = open(tmp, 'w')
+        json.dump(state, fout)
+        fout.close()
+        os.rename(tmp, filename)
+        return filename
+
+    def restore_state(self, filename):
+        """
+        Resume the session saved in `filename` by save_state(), without
+        making any requests.  The snapshot must be for this session's mirror.
+        """
+        state = json.load(open(filename))
+        if state['mirror'] != self.mirror:
+            raise ValueError('state in %s is for mirror %s, not %s'
+                             % (filename, state['mirror'], self.mirror))
+        self._set_hgsid(state['hgsid'])
+        if self._session is not None:
+            self._session.params['hgsid'] = state['hgsid']
+        self._batch = None
+        self.cart.invalidate()
+        if state.get('cart') is not None:
+            self.cart.restore(state['cart'])
+        self._reset_tracks()
+        return self
+
     def set_genome(self, assembly):
         """
         Change the genome assembly to anything supported by the mirror you're
@@ -70,13 +282,58 @@ class _UCSCSession(object):
     def session(self):
         """
         Creates a new session if none exists, or if the mirror has changed.
+
+        All requests go through this session's pooled connections; see
+        ucscsession.transport for how they are configured.  The session,
+        including its hgsid, is set up at most once even if several threads
+        use it at the same time.
+        """
+        session = self._session
+        if (self.mirror == self._mirror) and (session is not None):
+            return session
+        with self._session_lock:
+            mirror = self.mirror
+            if (mirror != self._mirror) or (self._session is None):
+                logger.debug('initializing session')
+                session = transport.make_session()
+                session.hooks['response'].append(self._record_response)
+                session.params = dict(hgsid=self._new_hgsid(session))
+                # Only publish the session once it's ready to use
+                self._session = session
+                self._mirror = mirror
+            return self._session
+
+    def _record_response(self, response, **kwargs):
+        if self.metrics is not None:
+            self.metrics.record_response(response, kwargs.get('stream'))
+
+    def _parse(self, parser, func, *args):
+        """
+        Return func(*args), recording the time taken as `parser` in
+        self.metrics (if enabled).
+        """
+        if self.metrics is None:
+            return func(*args)
+        t0 = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.metrics.record_parse(parser, time.time() - t0)
+
+    def _sleep(self, seconds, reason):
+        time.sleep(seconds)
+        if self.metrics is not None:
+            self.metrics.record_sleep(reason, seconds)
+
+    @property
+    def mirror(self):
         """
-        if (settings.mirror != self._mirror) or (self._session is None):
-            logger.debug('initializing session')
-            self._mirror = settings.mirror
-            self._session = requests.session()
-            self._session.params=dict(hgsid=self.hgsid)
-        return self._session
+        The mirror used by this session: settings.mirror for the shared
+        session, or the one it was created with for independent sessions.
+        """
+        if self._shared:
+            return settings.mirror
+        return self._own_mirror
 
     @property
     def hgsid(self):
@@ -84,19 +341,43 @@ class _UCSCSession(object):
         Get a new hgsid if one has not been set or if the mirror has changed;
         otherwise return the existing one.
         """
-        if (settings.hgsid is None) or (self._mirror != settings.mirror):
-            hgsid_logger.debug('new hgsid: %s' % settings.hgsid)
-            settings.hgsid = helpers.hgsid_from_response(
-                requests.get(self.gateway_url))
-        hgsid_logger.debug('hgsid=%s' % settings.hgsid)
-        return settings.hgsid
+        session = self.session
+        if self._get_hgsid() is None:
+            with self._session_lock:
+                if self._get_hgsid() is None:
+                    session.params['hgsid'] = self._new_hgsid(session)
+        hgsid_logger.debug('hgsid=%s' % self._get_hgsid())
+        return self._get_hgsid()
+
+    def _new_hgsid(self, session):
+        """
+        Return the current hgsid, first getting one from the server with
+        `session` if none has been set.  Call with self._session_lock held.
+        """
+        if self._get_hgsid() is None:
+            self._set_hgsid(self._parse(
+                'hgsid', helpers.hgsid_from_response,
+                session.get(self.gateway_url, params=dict(hgsid=None))))
+            hgsid_logger.debug('new hgsid: %s' % self._get_hgsid())
+        return self._get_hgsid()
+
+    def _get_hgsid(self):
+        if self._shared:
+            return settings.hgsid
+        return self._own_hgsid
+
+    def _set_hgsid(self, hgsid):
+        if self._shared:
+            settings.hgsid = hgsid
+        else:
+            self._own_hgsid = hgsid
 
     # -------------------------------------------------------------------------
     # Here are a bunch of getter methods that provide up-to-date URLs depending
-    # on the current state of settings.mirror.
+    # on the current mirror.
     @property
     def url(self):
-        return os.path.join(settings.mirror, 'cgi-bin')
+        return os.path.join(self.mirror, 'cgi-bin')
 
     @property
     def gateway_url(self):
@@ -141,57 +422,155 @@ class _UCSCSession(object):
         logger.debug('accessing cart')
         if response is None:
             response = self.session.get(self.cart_url)
-        b = BeautifulSoup(response.text)
-        d = {}
-        for i in b.pre.text.splitlines(False):
-            items = i.split(None, 1)
-            if len(items) == 1:
-                k, v = items[0], None
-            else:
-                k, v = items
-            d[k] = v
-        return d
+        return self._parse('cart', parsing.cart, response)
 
     def update_session(self, keys=None):
+        """
+        Copy cart variables into the parameters sent with every request.
+
+        If `keys` is None, the whole cart is re-synced from the server and
+        copied; otherwise only `keys` are copied, and the server is only
+        consulted for those not already known.
+        """
         logger.debug('Updating session with cart info')
-        cart_info = self.cart_info()
         if keys is None:
-            self.session.params.update(cart_info)
+            self.session.params.update(self.cart.sync())
         else:
             for key in keys:
-                self.session.params[key] = cart_info[key]
+                self.session.params[key] = self.cart[key]
 
-    def upload_track(self, track, trackline=None):
+    def upload_track(self, track, trackline=None, compress=None):
         """
         Uploads a track, providing an optional track line.
 
+        `track` is a filename or pybedtools.BedTool.  It is streamed to the
+        server as it is read, with the track line prepended on the fly, so
+        large files are never loaded into memory.
+
         The track line will automatically have a newline added if none exists.
+
+        If `compress` is True, the track is gzipped on the fly as it is sent
+        (see ucscsession.upload); if False it is sent uncompressed.  By
+        default, only large tracks are compressed (see
+        settings.gzip_threshold).
+
+        If self.upload_index is set (see settings.dedup_uploads), tracks
+        whose contents and track line have already been uploaded to this
+        session and assembly -- and whose custom tracks are still in the
+        cart -- are skipped, and None is returned.  Uploads are then
+        serialized, since the cart is compared before and after each one to
+        find out which custom tracks it created.
         """
-        if isinstance(track, pybedtools.BedTool):
-            if trackline:
-                track = track.saveas(trackline=trackline)
-            track = track.fn
-        else:
-            if trackline:
-                fout = open(pybedtools.BedTool._tmp(), 'w')
-                fout.write(trackline.rstrip() + '\n')
-                fout.write(open(track).read())
-                fout.close()
-                track = fout.name
-
-        logger.debug('Uploading track from file %s' % track)
+        self.flush()
+        digest = None
+        if self.upload_index is not None:
+            digest = upload.track_digest(track, trackline)
+        if digest is None:
+            return self._upload_track(track, trackline, compress)
+
+        with self._upload_lock:
+            key = (self.mirror, self.hgsid, self.cart.get('db'), digest)
+            before = set(k for k in self.cart if k.startswith('ct_'))
+            existing = self.upload_index.get(*key)
+            if existing and before.issuperset(existing):
+                logger.info('Skipping upload of %s; already uploaded as %s'
+                            % (track, ', '.join(existing)))
+                return None
+            response = self._upload_track(track, trackline, compress)
+            created = set(k for k in self.cart if k.startswith('ct_'))
+            created.difference_update(before)
+            if created:
+                self.upload_index.put(*(key + (created,)))
+            else:
+                # The upload replaced existing custom tracks (e.g., one with
+                # the same name), so any of the recorded uploads may no
+                # longer be what their cart variables hold
+                logger.debug('no new custom tracks found in cart for %s; '
+                             'forgetting earlier uploads' % track)
+                self.upload_index.clear(*key[:3])
+            return response
+
+    def _upload_track(self, track, trackline=None, compress=None):
+        body = upload.track_body(track, trackline, compress=compress)
+        logger.debug('Uploading track %s' % track)
         response = self.session.post(
             self.custom_url,
-            files={'hgt.customFile': open(track)}
+            data=body,
+            headers={'Content-Type': body.content_type}
         )
 
         # mis-formatted files will fail silently, so we need to check the html
         # response for an error.
-        soup = BeautifulSoup(response.content)
-        for p in soup.find_all('p'):
-            for s in p.find_all('span'):
-                if s.text == 'Error':
-                    raise ValueError(repr(p.text))
+        self.cart.invalidate()
+        self._reset_tracks()
+        errors = self._parse('errors', parsing.errors, response)
+        if errors:
+            raise ValueError(repr(errors[0]))
+
+        # hgCustom starts a new cart for requests without a known hgsid, in
+        # which case the track is not in this session's cart at all.  (This
+        # is the hgsid that was sent, which login() doesn't change.)
+        sent = str(self.session.params.get('hgsid'))
+        hgsids = self._parse('hgsids', parsing.hgsids, response)
+        if hgsids and hgsids != set([sent]):
+            raise ValueError('%s was added to the cart for hgsid %s, not %s'
+                             % (track, ', '.join(sorted(hgsids)), sent))
+        return response
+
+    def upload_tracks(self, tracks, workers=4, compress=None):
+        """
+        Upload many tracks concurrently using `workers` threads.
+
+        Each of `tracks` is either a filename or pybedtools.BedTool, or a
+        (track, trackline) tuple.  A track that fails to upload (e.g.,
+        because hgCustom reports it as mis-formatted) doesn't stop the
+        others.
+
+        Returns a ucscsession.batch.BatchResults list in the same order as
+        `tracks`, with the response (or exception) for each one; use its
+        `failed` attribute or raise_for_errors() method to check for
+        problems.  Uploads that hgCustom added to a cart other than this
+        session's count as failed.
+        """
+        self.flush()
+        items = []
+        for track in tracks:
+            if not isinstance(track, tuple):
+                track = (track, None)
+            items.append(track)
+
+        def _upload(item):
+            track, trackline = item
+            return self.upload_track(track, trackline, compress=compress)
+
+        # Set up the session and hgsid once, before the threads need them
+        self.session
+        results = run_batch(_upload, items, workers=workers)
+        logger.info('uploaded %s of %s tracks'
+                    % (len(results.succeeded), len(results)))
+        return results
+
+    def connect_hub(self, hub_url):
+        """
+        Connect the track hub at `hub_url` (the URL of its hub.txt) to this
+        session.
+
+        For large datasets this is much faster than upload_track, since the
+        Genome Browser only fetches the parts of the hub's bigBed and bigWig
+        files that it needs to draw each view.  See ucscsession.hub for
+        creating and serving hubs.
+        """
+        self.flush()
+        response = self.session.get(self.hub_url, params={
+            'hubUrl': hub_url,
+            'hgHub_do_redirect': 'on',
+            'hgHubConnect.remakeTrackHub': 'on',
+        })
+        self.cart.invalidate()
+        self._reset_tracks()
+        errors = self._parse('errors', parsing.errors, response)
+        if errors:
+            raise ValueError(repr(errors[0]))
         return response
 
     def show(self, position=None):
@@ -204,16 +583,26 @@ class _UCSCSession(object):
 
         If `position` is None, then just use the last position.
         """
-        self.set_position(position)
-        response = self.request_tracks()
+        with self.batch():
+            self.set_position(position)
+            response = self.request_tracks()
+        import webbrowser
         webbrowser.open(response.url, autoraise=self.autoraise)
-        time.sleep(self._SLEEP)
+        self._sleep(self._SLEEP, 'show')
         return response
 
     def request_tracks(self, data=None):
-        if data is None:
-            data = {}
-        response = self.session.get(self.tracks_url, data=data)
+        """
+        Request the hgTracks page with `data`, along with any changes
+        gathered in a batch() block.
+        """
+        payload = self._take_pending()
+        if data:
+            payload.update(data)
+        response = self.session.get(self.tracks_url, data=payload)
+        if data:
+            # e.g., zooming changes the position in ways we can't predict
+            self.cart.invalidate()
         self._reset_tracks(response)
         return response
 
@@ -227,17 +616,79 @@ class _UCSCSession(object):
 
         Returns the created filename.
         """
-        payload = {'hgt.psOutput': 'on'}
-        payload.update(position=self._position_string(position))
-        response = self.session.post(self.tracks_url, data=payload)
-        time.sleep(self._SLEEP)
-        link = helpers.pdf_link(response)
-        logger.debug('PDF link: %s' % link)
         if filename is None:
+            import pybedtools
             filename = pybedtools.BedTool._tmp()
-        pdf_content = self.session.get(link)
-        fout = open(filename, 'w')
-        fout.write(pdf_content.content)
+        position = self._position_string(position)
+        filename = self._render_pdf(
+            position, filename, extra=self._take_pending())
+        self.cart.set_local(position=position)
+        return filename
+
+    def pdf_batch(self, intervals, outdir, workers=4):
+        """
+        Save a PDF for each of `intervals` into directory `outdir`.
+
+        `intervals` can be a pybedtools.BedTool or any iterable of position
+        strings or objects with chrom, start, stop attributes.  Up to
+        `workers` regions are rendered concurrently over pooled connections.
+        Filenames are derived from the position, e.g. "chr1_1_2000.pdf".
+
+        Returns a ucscsession.batch.BatchResults list in the same order as
+        `intervals`; each result has the position, the created filename as
+        its value (or the exception as its error) and the elapsed time.
+        """
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+        self.flush()
+        positions = [self._position_string(i) for i in intervals]
+
+        def render(position):
+            filename = os.path.join(
+                outdir,
+                position.replace(':', '_').replace('-', '_') + '.pdf')
+            return self._render_pdf(position, filename)
+
+        # Set up the session and hgsid once, before the threads need them
+        self.session
+        results = run_batch(render, positions, workers=workers)
+
+        # The server's position is now whichever region finished last
+        self.cart.invalidate()
+        logger.info('rendered %s of %s PDFs'
+                    % (len(results.succeeded), len(results)))
+        return results
+
+    def _render_pdf(self, position, filename, extra=None):
+        """
+        Request a PDF of `position` (or the current position if None) and
+        stream it to `filename` as soon as the server makes it available.
+
+        `extra` is an optional dictionary of other cart variables to send.
+        """
+        payload = dict(extra or {})
+        payload['hgt.psOutput'] = 'on'
+        if position is not None:
+            payload['position'] = position
+        response = self.session.post(self.tracks_url, data=payload)
+        link = self._parse('pdf_link', helpers.pdf_link, response)
+        if link is None:
+            raise ValueError('No PDF link found for %s' % position)
+        logger.debug('PDF link: %s' % link)
+        self._download(link, filename)
+        return filename
+
+    def _download(self, url, filename, chunk_size=65536):
+        """
+        Wait for `url` to become available according to self.poll_policy,
+        then stream it to `filename`.
+        """
+        response = self.poll_policy.poll(
+            probe_url(self.session, url, stream=True), description=url,
+            sleep=lambda seconds: self._sleep(seconds, 'poll'))
+        fout = open(filename, 'wb')
+        for chunk in response.iter_content(chunk_size):
+            fout.write(chunk)
         fout.close()
         return filename
 
@@ -264,23 +715,29 @@ class _UCSCSession(object):
         if password is None:
             password = getpass.getpass(prompt='\nPassword for %s: ' % self.url)
         hgsid_logger.debug('pre-login hgsid: %s' % self.hgsid)
+        self.flush()
         response = self.session.post(self.login_url, data={
             'hgLogin_username': username,
             'hgLogin_password': password,
             'action': 'hgLogin',
             'hgsid': None})
+        self.cart.invalidate()
         self.update_session(['hgLogin_username'])
-        settings.hgsid = helpers.hgsid_from_response(response)
+        self._set_hgsid(
+            self._parse('hgsid', helpers.hgsid_from_response, response))
         hgsid_logger.debug('post-login hgsid: %s' % self.hgsid)
         response = self.session.get(self.session_url)
         return response
 
 
     def load_settings(self, settings_filename):
+        self.flush()
         response = self.session.post(
             self.tracks_url,
             files={'hgS_loadLocalFileName': open(settings_filename)}
         )
+        self.cart.invalidate()
+        self._reset_tracks(response)
         return response
 
 
@@ -306,15 +763,149 @@ class _UCSCSession(object):
 
     @property
     def tracks(self):
-        if self._tracks is None:
-            self._reset_tracks()
+        """
+        Dictionary of {track id: Track} for the current view.
+
+        The most recent hgTracks page is only parsed when this is accessed.
+
+        If no page has been requested since the assembly was last set, the
+        assembly is known locally (see Cart.peek()) and self.catalog has an
+        entry for it on the current mirror, the tracks come from the catalog
+        with no network access.  In that case visibilities are the ones that
+        were current when the catalog entry was stored.
+        """
+        self._refresh_tracks()
         return self._tracks
 
     def _reset_tracks(self, response=None):
-        if not response:
-            response = self.session.get(self.tracks_url)
-        self._tracks = dict(
-            (i.id, i) for i in tracks_from_response(response, self))
+        """
+        Note that the track table should be updated from hgTracks `response`,
+        or from a newly-fetched page if `response` is None.
+
+        Nothing is parsed or fetched until the tracks are next accessed.
+        """
+        if response is None:
+            self._tracks_pending = None
+            self._tracks_stale = True
+        else:
+            self._tracks_pending = response.text
+            self._tracks_stale = False
+
+    def _refresh_tracks(self):
+        """
+        Bring self._tracks up to date with the pending hgTracks page.
+
+        Tracks are updated in place, so Track objects for unchanged tracks
+        are kept.  If the track controls on the page are identical to the
+        last page seen, the page is not parsed at all.
+        """
+        text = self._tracks_pending
+        if text is None:
+            if not self._tracks_stale:
+                return
+            if self._tracks is None and self._tracks_from_catalog():
+                return
+            # Any changes pending in a batch() block go along with it, so the
+            # page reflects them
+            self.request_tracks()
+            text = self._tracks_pending
+        self._tracks_pending = None
+        self._tracks_stale = False
+        digest = self._parse('controls_digest', controls_digest, text)
+        if (self._tracks is not None) and (digest == self._tracks_digest):
+            logger.debug('track controls unchanged; skipping parse')
+            return
+        if self._tracks is None:
+            self._tracks = {}
+        records = self._parse(
+            'tracks', lambda: list(iter_track_records([text], self.url)))
+        update_tracks(self._tracks, records, self)
+        self._tracks_digest = digest
+        if self.catalog is not None:
+            db = self.cart.peek('db') or parsing.db(text)
+            if db:
+                self.catalog.put(self.mirror, db, records)
+
+    def _tracks_from_catalog(self):
+        """
+        Populate self._tracks from self.catalog, if possible.  Returns True
+        on success.
+
+        Only an assembly that is already known locally (e.g., set with
+        set_genome() or restored with from_state()) is looked up, so this
+        never makes a request.
+        """
+        if self.catalog is None:
+            return False
+        db = self.cart.peek('db')
+        if not db:
+            return False
+        records = self.catalog.get(self.mirror, db)
+        if records is None:
+            return False
+        logger.debug('using cached track catalog for %s' % db)
+        self._tracks = {}
+        update_tracks(self._tracks, records, self)
+        self._tracks_stale = False
+        return True
+
+    def configure_tracks(self, configs, workers=4):
+        """
+        Configure many tracks with a single request.
+
+        `configs` is a dictionary of {track: {control name: value}}, where
+        `track` is a Track object or track ID, and the control names and
+        values are those on each track's config page (see ConfigPage).
+        Control names may leave off the "<track id>." prefix, e.g.:
+
+            configure_tracks({
+                'ct_bbed_5663': {'scoreFilter': 100, 'ct_bbed_5663': 'squish'},
+                'refGene': {'label.acc': 'on'},
+            })
+
+        The config pages are fetched concurrently using `workers` threads;
+        then the changes from all of them are sent together in a single
+        hgTracks request, and the track table is refreshed once.
+
+        Raises ValueError, without submitting anything, if any track can't
+        be configured as requested.
+        """
+        self.flush()
+        items = []
+        for track, values in configs.items():
+            if isinstance(track, basestring):
+                track = self.tracks[track]
+            items.append((track, values))
+
+        def configure(item):
+            track, values = item
+            config = track.config
+            for name, value in values.items():
+                prefixed = '%s.%s' % (track.id, name)
+                if (name not in config) and (prefixed in config):
+                    name = prefixed
+                config[name] = value
+            return config.data(hidden=False)
+
+        # Set up the session and hgsid once, before the threads need them
+        self.session
+        try:
+            results = run_batch(configure, items, workers=workers)
+            results.raise_for_errors()
+            data = {}
+            for result in results:
+                data.update(result.value)
+            logger.debug('configuring %s tracks with %s' % (len(items), data))
+            response = self.session.get(self.tracks_url, data=data)
+        finally:
+            # The config pages have been changed locally, and either no
+            # longer reflect the server or hold changes that were never
+            # sent, so drop them
+            for track, values in items:
+                track._config = None
+        self.cart.invalidate()
+        self._reset_tracks(response)
+        return response
 
     def set_track_visibilities(self, items):
         """
@@ -337,7 +928,8 @@ class _UCSCSession(object):
         Note that it is possible to call set_visibility() on each track
         separately, but this would trigger a separate request each time.
         Instead, this method allows you to set many visibilities with a single
-        request.
+        request.  Inside a batch() block, the request is deferred (see
+        batch()).
         """
         data = {}
         for track, visibility in items:
@@ -347,11 +939,18 @@ class _UCSCSession(object):
                 raise ValueError(
                     'visibility must be one of %s' % track._visibility_options)
             data[track.id] = visibility
+        self.cart.set_local(**data)
+        if self._batch is not None:
+            self._batch.update(data)
+            return None
         response = self.session.get(self.tracks_url, data=data)
+        self._reset_tracks(response)
         return response
 
 
 if __name__ == "__main__":
+    import pybedtools
+    logging.basicConfig(level=logging.INFO)
     u = UCSCSession()
     for fn in ['a.bed', 'b.bed']:
         x = pybedtools.example_bedtool(fn)\
@@ -1,2 +1,45 @@
 hgsid = None
 mirror = 'http://genome.ucsc.edu'
+
+# Filename of a SQLite database used to cache track catalogs across processes
+# (see ucscsession.catalog), and how long cached catalogs are valid, in
+# seconds.  Set to None to disable the cache.
+catalog_filename = None
+catalog_ttl = 7 * 24 * 3600
+
+# Connection pooling and retries for HTTP requests (see ucscsession.transport):
+# the maximum number of connections kept open to each host, how many times
+# to retry failed idempotent requests, and the backoff factor in seconds
+# between retries.
+pool_maxsize = 10
+max_retries = 3
+backoff_factor = 0.3
+
+# Custom tracks at least this many bytes are gzipped on the fly when uploaded
+# (set to None to never compress unless asked to), and the gzip compression
+# level to use.
+gzip_threshold = 10 * 1024 * 1024
+gzip_level = 6
+
+# The Genome Browser's CGIs need a Content-Length, so tracks that can only be
+# read once (BedTools created from streams or iterators) are spooled before
+# uploading: in memory up to this many bytes, then to a temporary file.
+upload_spool_size = 16 * 1024 * 1024
+
+# Skip uploading custom tracks whose contents have already been uploaded to
+# the same session (see ucscsession.dedup).  If upload_index_filename is set,
+# the record of uploads is stored in that SQLite database so it persists
+# across processes; otherwise it only lasts as long as the session.
+dedup_uploads = False
+upload_index_filename = None
+
+# Record all HTTP responses to, or replay them from, a directory of gzipped
+# fixtures (see ucscsession.fixtures).  fixture_mode is None (normal network
+# access), "record" or "replay".
+fixture_mode = None
+fixture_dir = None
+
+# A ucscsession.metrics.Metrics object that new sessions record requests,
+# sleeps and parse times in; None to disable.  Can also be set per session
+# (the session's `metrics` attribute).
+metrics = None
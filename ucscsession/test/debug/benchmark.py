@@ -0,0 +1,342 @@
+"""
+End-to-end benchmarks of ucscsession against a local mock Genome Browser
+(ucscsession.test.mockucsc), so results are reproducible and don't need
+network access.
+
+For each workflow this reports latency percentiles, throughput, the number of
+requests made to each CGI and the peak resident memory during the run (and
+how much it grew over the memory in use when the run started), sampled from
+/proc on Linux; elsewhere, only the peak over the whole process is known::
+
+    python ucscsession/test/debug/benchmark.py
+    python ucscsession/test/debug/benchmark.py --latency 0.05 -n 50 \\
+        --only navigation pdf --json results.json
+
+Simulated network latency (--latency) makes the number of round trips show
+up in the timings, much as it would against genome.ucsc.edu.  The mock server
+runs in a separate process, so peak memory is that of the client alone; with
+--in-process it runs in the same process, and peak memory includes it (e.g.,
+it holds whole uploaded tracks in memory).
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+
+import ucscsession
+from ucscsession import parsing
+from ucscsession.metrics import Metrics
+from ucscsession.tracks import iter_track_records
+from ucscsession.forms import forms_from_response
+from ucscsession.test.mockucsc import MockUCSC, MockUCSCProcess
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux and bytes on OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss /= 1024.
+    return rss / 1024.
+
+
+def current_rss_mb():
+    """
+    Current resident memory of this process, or None if it can't be read
+    (/proc is only available on Linux).
+    """
+    try:
+        pages = int(open('/proc/self/statm').read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() / 1024. / 1024.
+
+
+class MemorySampler(object):
+    """
+    Samples resident memory every `interval` seconds in a background thread,
+    keeping the largest value, so that the peak during one run can be found
+    (ru_maxrss is the peak over the life of the process).
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.start_mb is not None:
+            self._thread = threading.Thread(target=self._sample)
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+            self._stop.wait(self.interval)
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+def random_position():
+    start = random.randint(1, 200000000)
+    return 'chr%s:%s-%s' % (random.randint(1, 22), start,
+                            start + random.randint(1000, 100000))
+
+
+class Benchmark(object):
+    def __init__(self, server, args):
+        self.server = server
+        self.args = args
+        self.tmpdir = tempfile.mkdtemp(prefix='ucscsession-benchmark-')
+        self.results = []
+
+    def session(self):
+        return ucscsession.new_session(mirror=self.server.url)
+
+    def run(self, name, func, n, size=None):
+        """
+        Call `func(i)` for i in range(n) and record timing stats.  If `size`
+        is given (bytes per call), throughput is also reported in MB/s.
+        """
+        self.server.reset_counts()
+        times = []
+        with MemorySampler() as memory:
+            t0 = time.time()
+            for i in range(n):
+                t = time.time()
+                func(i)
+                times.append(time.time() - t)
+            total = time.time() - t0
+        result = dict(
+            name=name,
+            n=n,
+            total=total,
+            mean=sum(times) / n,
+            p50=percentile(times, 50),
+            p90=percentile(times, 90),
+            p99=percentile(times, 99),
+            max=max(times),
+            ops_per_sec=n / total,
+            requests=dict(self.server.requests),
+            peak_rss_mb=peak_rss_mb())
+        if memory.start_mb is not None:
+            result['run_peak_rss_mb'] = memory.peak_mb
+            result['run_rss_increase_mb'] = memory.peak_mb - memory.start_mb
+        if size is not None:
+            result['mb_per_sec'] = size * n / total / 1e6
+        self.results.append(result)
+        self.report(result)
+        return result
+
+    def report(self, r):
+        line = ('%-22s n=%-4d mean %7.1f ms  p50 %7.1f  p90 %7.1f  '
+                'p99 %7.1f  max %7.1f  %7.1f ops/s'
+                % (r['name'], r['n'], r['mean'] * 1000, r['p50'] * 1000,
+                   r['p90'] * 1000, r['p99'] * 1000, r['max'] * 1000,
+                   r['ops_per_sec']))
+        if 'mb_per_sec' in r:
+            line += '  %6.1f MB/s' % r['mb_per_sec']
+        print(line)
+        requests = ', '.join('%s=%s' % i for i in sorted(r['requests'].items()))
+        if 'run_peak_rss_mb' in r:
+            memory = 'peak RSS %.1f MB (+%.1f MB during this run)' % (
+                r['run_peak_rss_mb'], r['run_rss_increase_mb'])
+        else:
+            memory = 'peak RSS %.1f MB (since the process started)' \
+                % r['peak_rss_mb']
+        print('%-22s requests: %s; %s' % ('', requests or 'none', memory))
+
+    # -------------------------------------------------------------------------
+    # Workflows
+
+    def startup(self):
+        def start(i):
+            u = self.session()
+            u.hgsid
+            u.cart['db']
+            u.session.close()
+        self.run('startup', start, self.args.n)
+
+    def navigation(self):
+        u = self.session()
+        u.tracks
+
+        def navigate(i):
+            with u.batch():
+                u.set_position(random_position())
+                u.request_tracks()
+
+        def navigate_and_read(i):
+            navigate(i)
+            u.tracks['track000'].visibility
+
+        def zoom(i):
+            u.zoom_out(random.randint(1, 3))
+        self.run('navigate', navigate, self.args.n)
+        self.run('navigate+tracks', navigate_and_read, self.args.n)
+        self.run('zoom', zoom, self.args.n)
+        u.session.close()
+
+    def visibility(self):
+        u = self.session()
+        ids = sorted(u.tracks)
+
+        def set_visibilities(i):
+            u.set_track_visibilities(
+                [(t, random.choice(['hide', 'dense', 'pack']))
+                 for t in random.sample(ids, 20)])
+            u.tracks
+        self.run('set_visibilities(20)', set_visibilities, self.args.n)
+
+        def configure(i):
+            u.configure_tracks(dict(
+                (t, {'label.acc': random.choice(['on', []])})
+                for t in random.sample(ids, 5)))
+        self.run('configure_tracks(5)', configure, max(self.args.n // 5, 1))
+        u.session.close()
+
+    def parsing(self):
+        u = self.session()
+        tracks = u.session.get(u.tracks_url)
+        cart = u.session.get(u.cart_url)
+        config = u.session.get(u.tracks['track001'].url)
+        text = tracks.text
+        print('%-22s hgTracks page: %.0f KB' % ('', len(text) / 1024.))
+        self.run('parse tracks', lambda i: list(
+            iter_track_records([text], u.url)), self.args.n)
+
+        def parse_cart(i):
+            cart.__dict__.pop('_ucscsession_soup', None)
+            parsing.cart(cart)
+
+        def parse_config(i):
+            config.__dict__.pop('_ucscsession_soup', None)
+            forms_from_response(config)
+        self.run('parse cart', parse_cart, self.args.n)
+        self.run('parse config page', parse_config, self.args.n)
+        u.session.close()
+
+    def upload(self):
+        fn = os.path.join(self.tmpdir, 'upload.bed')
+        fout = open(fn, 'w')
+        size = 0
+        i = 0
+        while size < self.args.upload_mb * 1e6:
+            line = 'chr1\t%s\t%s\tfeature%s\t%s\t+\n' % (i * 100, i * 100 + 50,
+                                                        i, i % 1000)
+            fout.write(line)
+            size += len(line)
+            i += 1
+        fout.close()
+        u = self.session()
+        n = max(self.args.n // 10, 1)
+        for name, compress in [('upload', False), ('upload (gzip)', True)]:
+            # Bytes actually sent, from the request bodies
+            u.metrics = Metrics()
+            result = self.run(
+                name, lambda i, c=compress: u.upload_track(fn, compress=c),
+                n, size=size)
+            sent = u.metrics.requests['hgCustom'].sent / float(n)
+            result['sent_mb'] = sent / 1e6
+            print('%-22s sent %.1f MB per upload (%.0f%% of the track)'
+                  % ('', sent / 1e6, 100. * sent / size))
+        u.metrics = None
+        u.session.close()
+
+    def pdf(self):
+        u = self.session()
+        u.set_position('chr1:1-2000')
+        outdir = os.path.join(self.tmpdir, 'pdfs')
+        os.makedirs(outdir)
+        n = max(self.args.n // 5, 1)
+        self.run('pdf', lambda i: u.pdf(
+            filename=os.path.join(outdir, '%s.pdf' % i)), n)
+        positions = [random_position() for i in range(self.args.batch)]
+        self.run('pdf_batch(%s)' % self.args.batch,
+                 lambda i: u.pdf_batch(positions, outdir,
+                                       workers=self.args.workers)
+                 .raise_for_errors(), 1)
+        u.session.close()
+
+    def concurrency(self):
+        items = range(self.args.n)
+
+        def render(u, i):
+            with u.batch():
+                u.set_position(random_position())
+                u.request_tracks()
+            u.session.close()
+        self.run('fan_out(%s)' % self.args.n,
+                 lambda i: ucscsession.fan_out(
+                     render, items, workers=self.args.workers,
+                     mirror=self.server.url).raise_for_errors(), 1)
+
+    def cleanup(self):
+        shutil.rmtree(self.tmpdir)
+
+
+WORKFLOWS = ['startup', 'navigation', 'visibility', 'parsing', 'upload', 'pdf',
+             'concurrency']
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('-n', type=int, default=20,
+                    help='Iterations per workflow (default: %(default)s)')
+    ap.add_argument('--latency', type=float, default=0,
+                    help='Seconds of simulated latency per request')
+    ap.add_argument('--tracks', type=int, default=150,
+                    help='Number of tracks on hgTracks pages')
+    ap.add_argument('--padding', type=int, default=250000,
+                    help='Bytes of image map markup on hgTracks pages')
+    ap.add_argument('--pdf-delay', type=float, default=0.2,
+                    help='Seconds before rendered PDFs are available')
+    ap.add_argument('--upload-mb', type=float, default=20,
+                    help='Size of the uploaded track, in MB')
+    ap.add_argument('--batch', type=int, default=10,
+                    help='Number of regions for pdf_batch')
+    ap.add_argument('--workers', type=int, default=4,
+                    help='Threads for pdf_batch and fan_out')
+    ap.add_argument('--only', nargs='+', choices=WORKFLOWS,
+                    help='Only run these workflows')
+    ap.add_argument('--in-process', action='store_true',
+                    help='Run the mock server in this process rather than a '
+                    'separate one')
+    ap.add_argument('--json', help='Also write results to this JSON file')
+    args = ap.parse_args()
+
+    random.seed(0)
+    mock = MockUCSC if args.in_process else MockUCSCProcess
+    server = mock(latency=args.latency, n_tracks=args.tracks,
+                  padding=args.padding, pdf_delay=args.pdf_delay).start()
+    bench = Benchmark(server, args)
+    try:
+        for name in args.only or WORKFLOWS:
+            print('\n[%s]' % name)
+            getattr(bench, name)()
+    finally:
+        bench.cleanup()
+        server.stop()
+    if args.json:
+        json.dump(bench.results, open(args.json, 'w'), indent=2)
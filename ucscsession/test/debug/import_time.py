@@ -0,0 +1,96 @@
+"""
+Measure how long `import ucscsession` takes, and check that it doesn't import
+any of the slow optional dependencies (which should only be imported when
+they're first needed).
+
+Each measurement runs in a fresh interpreter.  Exits non-zero if a deferred
+module was imported or the median import time exceeds --max-ms, so it can be
+used to guard against regressions::
+
+    python ucscsession/test/debug/import_time.py --max-ms 100
+
+Interpreters that support it (Python 3.7+) also get a per-module breakdown
+from "-X importtime".
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Modules that importing ucscsession should not pull in
+DEFERRED = ['pybedtools', 'bs4', 'lxml', 'requests', 'webbrowser',
+            'multiprocessing', 'uuid', 'ctypes']
+
+_SNIPPET = """
+import sys, time, json
+t0 = time.time()
+import ucscsession
+elapsed = time.time() - t0
+json.dump({'elapsed': elapsed,
+           'loaded': [m for m in %r if m in sys.modules]}, sys.stdout)
+""" % (DEFERRED,)
+
+_ROOT = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+
+
+def measure(python):
+    p = subprocess.Popen([python, '-c', _SNIPPET], cwd=_ROOT,
+                         stdout=subprocess.PIPE)
+    out = p.communicate()[0]
+    if p.returncode:
+        raise RuntimeError('import failed')
+    return json.loads(out)
+
+
+def importtime(python, top=15):
+    """
+    Print the `top` modules with the largest self time, as reported by
+    "-X importtime".
+    """
+    p = subprocess.Popen([python, '-X', 'importtime', '-c',
+                          'import ucscsession'], cwd=_ROOT,
+                         stderr=subprocess.PIPE, universal_newlines=True)
+    err = p.communicate()[1]
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'self' in line:
+            continue
+        fields = line.split('|')
+        rows.append((int(fields[0].split(':')[1]), fields[2].strip()))
+    print('\nlargest self times (us):')
+    for us, name in sorted(rows, reverse=True)[:top]:
+        print('%10d  %s' % (us, name))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--python', default=sys.executable,
+                    help='Interpreter to test (default: %(default)s)')
+    ap.add_argument('-n', type=int, default=10,
+                    help='Number of runs (default: %(default)s)')
+    ap.add_argument('--max-ms', type=float,
+                    help='Fail if the median import time exceeds this')
+    args = ap.parse_args()
+
+    runs = [measure(args.python) for i in range(args.n)]
+    times = sorted(i['elapsed'] * 1000 for i in runs)
+    median = times[len(times) // 2]
+    loaded = sorted(set(sum((i['loaded'] for i in runs), [])))
+    print('import ucscsession: median %.1f ms, min %.1f ms, max %.1f ms '
+          '(%s runs)' % (median, times[0], times[-1], args.n))
+
+    version = subprocess.check_output(
+        [args.python, '-c', 'import sys; print(sys.version_info[:2])'])
+    if tuple(int(i) for i in version.strip().strip('()').split(',')) >= (3, 7):
+        importtime(args.python)
+
+    failed = False
+    if loaded:
+        print('FAIL: deferred modules were imported: %s' % ', '.join(loaded))
+        failed = True
+    if args.max_ms is not None and median > args.max_ms:
+        print('FAIL: median import time exceeds %s ms' % args.max_ms)
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,293 @@
+"""
+Microbenchmarks of the HTML parsers in ucscsession.
+
+Pages come from a corpus recorded with settings.fixture_mode = "record" (see
+ucscsession.fixtures), or if no corpus is given, from the mock server in
+ucscsession.test.mockucsc with many tracks (as on hgTracks pages with all
+track groups expanded).  Each parser is run repeatedly on fresh response
+objects, so the cached parse in ucscsession.parsing isn't re-used, and
+timings are reported in the style of pytest-benchmark::
+
+    python ucscsession/test/debug/parser_benchmark.py --save baseline.json
+    # ... change the parsers ...
+    python ucscsession/test/debug/parser_benchmark.py --compare baseline.json
+
+With --compare, exits non-zero if any parser's fastest time is more than
+--max-regression percent slower than in the saved results.
+
+The memory held by the track table for the hgTracks page is also reported,
+both for the current Track objects and for Tracks as they were before
+TrackRecord (attributes in an instance dictionary, plus the BeautifulSoup
+<td> they were extracted from, which keeps the whole parsed page alive).
+"""
+import os
+import gc
+import sys
+import json
+import time
+import math
+import types
+import argparse
+import urlparse
+import posixpath
+
+from ucscsession import parsing, helpers
+from ucscsession.tracks import (iter_track_records, tracks_from_response,
+                                controls_digest, update_tracks)
+from ucscsession.forms import forms_from_response
+
+
+class Page(object):
+    """
+    Minimal stand-in for a requests.Response, with the attributes the
+    parsers use.
+    """
+    def __init__(self, text, url):
+        self.text = text
+        self.url = url
+
+
+class _Session(object):
+    def __init__(self, url):
+        self.url = url
+
+
+def cgi(url):
+    return posixpath.basename(posixpath.normpath(urlparse.urlsplit(url).path))
+
+
+def pages_from_fixtures(directory):
+    from ucscsession.fixtures import fixture_store
+    pages = {}
+    for record in fixture_store(directory).records():
+        content_type = dict((k.lower(), v) for k, v in
+                            record['headers'].items()).get('content-type', '')
+        if record['status'] != 200 or not content_type.startswith('text/html'):
+            continue
+        text = record['body'].decode('utf-8', 'replace')
+        name = cgi(record['url'])
+        if name == 'hgTracks':
+            if 'hgt_genome_' in text:
+                name = 'hgTracks (pdf)'
+            elif '<select' not in text.lower():
+                continue
+        # Keep the largest page of each kind
+        if len(text) > len(pages.get(name, ('', ''))[0]):
+            pages[name] = (text, record['url'])
+    return pages
+
+
+def pages_from_mock(n_tracks):
+    import requests
+    from ucscsession.test.mockucsc import MockUCSC
+    pages = {}
+    with MockUCSC(n_tracks=n_tracks, pdf_delay=0) as server:
+        url = server.url + '/cgi-bin/'
+        s = requests.Session()
+        hgsid = s.get(url + 'hgGateway').text.split(
+            'NAME="hgsid" VALUE="')[1].split('"')[0]
+        params = dict(hgsid=hgsid)
+        for name, path, extra in [
+                ('hgTracks', 'hgTracks', {}),
+                ('hgTracks (pdf)', 'hgTracks', {'hgt.psOutput': 'on'}),
+                ('cartDump', 'cartDump', {}),
+                ('hgTrackUi', 'hgTrackUi', {'g': 'track001'})]:
+            r = s.get(url + path, params=dict(params, **extra))
+            pages[name] = (r.text, r.url)
+        s.close()
+    return pages
+
+
+def benchmarks(pages):
+    """
+    Yield (name, function) for each benchmark that applies to `pages`.
+    """
+    def fresh(name):
+        text, url = pages[name]
+        return lambda: Page(text, url)
+
+    if 'hgTracks' in pages:
+        tracks_page = fresh('hgTracks')
+        text, url = pages['hgTracks']
+        base = url.split('/cgi-bin/')[0] + '/cgi-bin'
+        chunks = [text[i:i + 65536] for i in range(0, len(text), 65536)]
+        yield ('iter_track_records', lambda: list(
+            iter_track_records([text], base)))
+        yield ('iter_track_records (64K chunks)', lambda: list(
+            iter_track_records(chunks, base)))
+        yield ('tracks_from_response', lambda: tracks_from_response(
+            tracks_page(), _Session(base)))
+        yield 'controls_digest', lambda: controls_digest(text)
+        yield ('hgsid_from_response',
+               lambda: helpers.hgsid_from_response(tracks_page()))
+        yield ('track_cells (BeautifulSoup)',
+               lambda: parsing.track_cells(tracks_page()))
+    if 'hgTracks (pdf)' in pages:
+        pdf_page = fresh('hgTracks (pdf)')
+        yield 'pdf_link', lambda: helpers.pdf_link(pdf_page())
+    if 'cartDump' in pages:
+        cart_page = fresh('cartDump')
+        yield 'cart', lambda: parsing.cart(cart_page())
+    if 'hgTrackUi' in pages:
+        config_page = fresh('hgTrackUi')
+        yield ('forms_from_response',
+               lambda: forms_from_response(config_page()))
+    if 'hgCustom' in pages:
+        custom_page = fresh('hgCustom')
+        yield 'errors', lambda: parsing.errors(custom_page())
+
+
+class SoupTrack(object):
+    """
+    A Track as it was before TrackRecord, for comparing memory use.
+    """
+    def __init__(self, td, base_url):
+        a = td('a')[-1]
+        self._td = td
+        self.ucsc_session = None
+        self.url = os.path.join(base_url, a['href'])
+        self.visibility = td('option', selected=True)[0].text
+        self._visibility_options = [i.text for i in td('option')]
+        self.id = td('select')[0]['name']
+        self.label = a.text.strip()
+        self.title = a.get('title', self.label)
+        self._config = None
+
+
+def soup_tracks(page, base_url):
+    """
+    Dictionary of {id: SoupTrack} for the track cells of `page`, filtered
+    as they were before TrackRecord.
+    """
+    tracks = {}
+    for td in parsing.track_cells(page):
+        td_str = str(td)
+        if ('toggleButton' in td_str) or ('hgt.refresh' in td_str) \
+                or ('[No data' in td_str) or td('b'):
+            continue
+        if not td('a') or len(td('select')) != 1 \
+                or not td('option', selected=True):
+            continue
+        track = SoupTrack(td, base_url)
+        tracks[track.id] = track
+    return tracks
+
+
+_SKIP = (type, types.ClassType, types.ModuleType, types.FunctionType,
+         types.BuiltinFunctionType)
+
+
+def deep_size(obj):
+    """
+    Total sys.getsizeof() of `obj` and every object reachable from it,
+    except for classes, modules and functions.
+    """
+    seen = set()
+    todo = [obj]
+    size = 0
+    while todo:
+        o = todo.pop()
+        if id(o) in seen or isinstance(o, _SKIP):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        todo.extend(gc.get_referents(o))
+    return size
+
+
+def track_memory(pages):
+    """
+    Return [(name, number of tracks, bytes)] for the track table built from
+    the hgTracks page in `pages` by each Track implementation.
+    """
+    text, url = pages['hgTracks']
+    base = url.split('/cgi-bin/')[0] + '/cgi-bin'
+    current = update_tracks(
+        {}, list(iter_track_records([text], base)), None)
+    before = soup_tracks(Page(text, url), base)
+    return [('Track (TrackRecord)', len(current), deep_size(current)),
+            ('Track (BeautifulSoup <td>)', len(before), deep_size(before))]
+
+
+def measure(func, min_time, min_rounds):
+    """
+    Time `func` for at least `min_rounds` rounds and `min_time` seconds.
+    """
+    times = []
+    start = time.time()
+    while len(times) < min_rounds or time.time() - start < min_time:
+        t = time.time()
+        func()
+        times.append(time.time() - t)
+    times.sort()
+    mean = sum(times) / len(times)
+    return dict(
+        min=times[0],
+        max=times[-1],
+        mean=mean,
+        stddev=math.sqrt(sum((i - mean) ** 2 for i in times) / len(times)),
+        median=times[len(times) // 2],
+        rounds=len(times))
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--fixtures', help='Directory of recorded responses')
+    ap.add_argument('--tracks', type=int, default=3000,
+                    help='Tracks on generated hgTracks pages, if --fixtures '
+                    'is not given (default: %(default)s)')
+    ap.add_argument('--min-time', type=float, default=1.0,
+                    help='Minimum seconds per benchmark')
+    ap.add_argument('--min-rounds', type=int, default=5,
+                    help='Minimum rounds per benchmark')
+    ap.add_argument('--only', nargs='+', help='Only run these benchmarks')
+    ap.add_argument('--save', help='Save results to this JSON file')
+    ap.add_argument('--compare', help='Compare to results in this JSON file')
+    ap.add_argument('--max-regression', type=float, default=10,
+                    help='With --compare, the allowed slowdown in percent '
+                    '(default: %(default)s)')
+    args = ap.parse_args()
+
+    if args.fixtures:
+        pages = pages_from_fixtures(args.fixtures)
+    else:
+        pages = pages_from_mock(args.tracks)
+    for name, (text, url) in sorted(pages.items()):
+        print('%-16s %8.0f KB  %s' % (name, len(text) / 1024., url))
+
+    if 'hgTracks' in pages:
+        print('\n%-32s %8s %10s %10s' % ('track table', 'tracks', 'KB',
+                                         'bytes/track'))
+        for name, n, size in track_memory(pages):
+            print('%-32s %8d %10.0f %10.0f'
+                  % (name, n, size / 1024., size / float(max(n, 1))))
+
+    baseline = {}
+    if args.compare:
+        baseline = json.load(open(args.compare))
+
+    print('\n%-32s %10s %10s %10s %10s %8s %s'
+          % ('name', 'min (ms)', 'max', 'mean', 'stddev', 'rounds',
+             '' if not baseline else 'vs. baseline (min)'))
+    results = {}
+    regressions = []
+    for name, func in benchmarks(pages):
+        if args.only and name not in args.only:
+            continue
+        r = results[name] = measure(func, args.min_time, args.min_rounds)
+        line = ('%-32s %10.3f %10.3f %10.3f %10.3f %8d'
+                % (name, r['min'] * 1000, r['max'] * 1000, r['mean'] * 1000,
+                   r['stddev'] * 1000, r['rounds']))
+        if name in baseline:
+            change = (r['min'] / baseline[name]['min'] - 1) * 100
+            line += ' %+7.1f%%' % change
+            if change > args.max_regression:
+                regressions.append(name)
+        print(line)
+
+    if args.save:
+        json.dump(results, open(args.save, 'w'), indent=2, sort_keys=True)
+    if regressions:
+        print('\nFAIL: slower than baseline by more than %s%%: %s'
+              % (args.max_regression, ', '.join(regressions)))
+        sys.exit(1)
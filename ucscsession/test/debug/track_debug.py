@@ -1,25 +1,23 @@
 """
-useful for debugging ucscsession.tracks.Track
+useful for debugging ucscsession.tracks.iter_track_records
 """
 import webbrowser
 import ucscsession
 import ucscsession.tracks
+import ucscsession.parsing
 import pybedtools
-from bs4 import BeautifulSoup
 
 reload(ucscsession)
 reload(ucscsession.tracks)
 
 u = ucscsession.UCSCSession()
 response = u.session.get(u.tracks_url)
-b = BeautifulSoup(response.text)
+cells = ucscsession.parsing.track_cells(response)
 
-cells = b('td')
-
-# Adjust `start` to skip <td>s with problems
+# Adjust `start` to skip <td>s with problems; cells that aren't recognized as
+# tracks are printed.
 start = 50
 for i in range(start, len(cells)):
-    try:
-        ucscsession.tracks.Track(cells[i], u)
-    except ucscsession.tracks.TrackException as e:
-        print e.message
+    cell = u''.join(unicode(j) for j in cells[i].contents)
+    if ucscsession.tracks._record_from_cell(cell, u.url) is None:
+        print cell
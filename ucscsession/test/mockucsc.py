@@ -0,0 +1,605 @@
+"""
+A local stand-in for the UCSC Genome Browser CGIs, for benchmarks and
+debugging without network access.
+
+MockUCSC emulates just enough of hgGateway, cartDump, hgTracks, hgCustom,
+hgLogin, hgSession and hgTrackUi for ucscsession to work against it: each
+hgsid has its own cart, the hgTracks track table reflects the cart, custom
+tracks can be uploaded (plain or gzipped; like the real CGIs, bodies sent
+with chunked transfer encoding are rejected), and rendered PDFs appear in
+the trash directory after a delay.  Page sizes and per-request latency are
+configurable.
+
+Usage::
+
+    from ucscsession.test.mockucsc import MockUCSC
+    with MockUCSC(latency=0.05) as server:
+        u = ucscsession.new_session(mirror=server.url)
+        u.set_position('chr1:1-2000')
+        u.pdf(filename='example.pdf')
+        print server.requests
+"""
+import re
+import time
+import zlib
+import random
+import socket
+import urlparse
+import threading
+import posixpath
+import collections
+import multiprocessing
+import SocketServer
+import BaseHTTPServer
+
+VISIBILITIES = ['hide', 'dense', 'squish', 'pack', 'full']
+
+_GROUPS = ['Mapping and Sequencing', 'Genes and Gene Predictions',
+           'Phenotype and Literature', 'mRNA and EST', 'Expression',
+           'Regulation', 'Comparative Genomics', 'Variation', 'Repeats']
+
+_POSITION = re.compile(r'^(\w+):([\d,]+)-([\d,]+)$')
+_ZOOM = {'1': 1.5, '2': 3.0, '3': 10.0}
+
+
+class _Session(object):
+    """
+    Server-side state for one hgsid.
+    """
+    def __init__(self):
+        self.cart = {'db': 'hg19', 'position': 'chr1:1-10000'}
+        # custom track id -> (label, number of lines)
+        self.custom = collections.OrderedDict()
+
+
+class MockUCSC(object):
+    """
+    Mock Genome Browser server.
+
+    `latency` is the number of seconds to wait before answering each request;
+    it can also be a dictionary of {CGI name: seconds} (e.g.,
+    {'hgTracks': 0.5}), with other CGIs answering immediately.  `n_tracks`
+    tracks are shown on hgTracks pages, which are padded with image map
+    markup to about `padding` more bytes (real pages are a few hundred KB).
+    Rendered PDFs of `pdf_size` bytes become available `pdf_delay` seconds
+    after they are requested.
+
+    If `users` is a dictionary of {username: password}, hgLogin checks
+    passwords against it; otherwise any login succeeds.
+    """
+    def __init__(self, host='127.0.0.1', port=0, latency=0, n_tracks=150,
+                 padding=250000, pdf_delay=0.2, pdf_size=100000, users=None):
+        self.latency = latency
+        self.n_tracks = n_tracks
+        self.padding = padding
+        self.pdf_delay = pdf_delay
+        self.pdf_size = pdf_size
+        self.users = users
+        self.sessions = {}
+        self.trash = {}
+        # Number of requests, per CGI name (or "trash")
+        self.requests = collections.Counter()
+        # Parameters of the most recent request to each CGI
+        self.last_params = {}
+        self._next_hgsid = 311279751
+        self._lock = threading.Lock()
+        self._tracks = [
+            ('track%03d' % i, 'Track %s' % i, 'Mock track number %s' % i,
+             _GROUPS[i * len(_GROUPS) // max(n_tracks, 1)])
+            for i in range(n_tracks)]
+        self._server = _ThreadingServer((host, port), _Handler)
+        self._server.mock = self
+        self._thread = None
+
+    def __repr__(self):
+        return '<MockUCSC %s>' % self.url
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._thread.join()
+        self._server.close_connections()
+        self._server.join_threads()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reset_counts(self):
+        self.requests.clear()
+
+    def delay(self, cgi):
+        if isinstance(self.latency, dict):
+            return self.latency.get(cgi, 0)
+        return self.latency
+
+    # -------------------------------------------------------------------------
+    # Sessions
+
+    def new_hgsid(self):
+        with self._lock:
+            hgsid = str(self._next_hgsid)
+            self._next_hgsid += 1
+            self.sessions[hgsid] = _Session()
+        return hgsid
+
+    def session(self, hgsid):
+        """
+        Return (hgsid, _Session), creating a new session if `hgsid` is
+        missing or unknown.
+        """
+        if not hgsid or hgsid not in self.sessions:
+            hgsid = self.new_hgsid()
+        return hgsid, self.sessions[hgsid]
+
+    # -------------------------------------------------------------------------
+    # CGIs.  Each takes the hgsid, _Session, parameters and request body, and
+    # returns (status, content type, body).
+
+    def hgGateway(self, hgsid, s, params, body):
+        return self._page(hgsid, '<h2>Genome Browser Gateway</h2>')
+
+    def cartDump(self, hgsid, s, params, body):
+        lines = ['%s %s' % (k, v) for k, v in sorted(s.cart.items())]
+        return 200, 'text/html', (
+            '<html><head><title>Cart Dump</title></head><body><tt><pre>%s\n'
+            '</pre></tt></body></html>' % _escape('\n'.join(lines)))
+
+    def hgTracks(self, hgsid, s, params, body):
+        for level, factor in _ZOOM.items():
+            if 'hgt.out' + level in params:
+                self._zoom(s, factor)
+            if 'hgt.in' + level in params:
+                self._zoom(s, 1 / factor)
+        if params.get('hgt.psOutput') == 'on':
+            name = 'hgt_genome_%s_%06x.pdf' % (hgsid,
+                                               random.randint(0, 0xffffff))
+            with self._lock:
+                self.trash[name] = time.time() + self.pdf_delay
+            return self._page(
+                hgsid, '<h2>PDF Output</h2>'
+                '<UL><LI>Download <A HREF="../trash/hgt/%s">the current '
+                'browser graphic in PDF</A></UL>' % name)
+        return self._page(hgsid, self._track_table(hgsid, s))
+
+    def hgCustom(self, hgsid, s, params, body):
+        if not body:
+            return self._page(hgsid, '<h2>Add Custom Tracks</h2>')
+        filename, data = body
+        if filename.endswith('.gz'):
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        label = 'User Track'
+        n = 0
+        for i, line in enumerate(data.splitlines()):
+            if not line.strip() or line.startswith(('browser', '#')):
+                continue
+            if line.startswith('track'):
+                m = re.search(r'name=("[^"]*"|\S+)', line)
+                if m:
+                    label = m.group(1).strip('"')
+                continue
+            fields = line.split('\t') if '\t' in line else line.split()
+            if len(fields) < 3 or not (fields[1].isdigit()
+                                       and fields[2].isdigit()):
+                return self._page(
+                    hgsid, '<P><span class="error">Error</span> File '
+                    "'%s' - Error line %s: expecting chrom, start, end</P>"
+                    % (_escape(filename), i + 1))
+            n += 1
+        with self._lock:
+            # As on the real server, a track with the same name as an
+            # existing one replaces it
+            for track_id, (existing, _) in s.custom.items():
+                if existing == label:
+                    break
+            else:
+                track_id = 'ct_%s_%s' % (re.sub(r'\W', '', label).lower(),
+                                         random.randint(1000, 9999))
+            s.custom[track_id] = (label, n)
+            s.cart[track_id] = 'dense'
+        return self._page(
+            hgsid, '<h2>Manage Custom Tracks</h2><TABLE><TR><TD>%s</TD>'
+            '<TD>%s items</TD></TR></TABLE>' % (_escape(label), n))
+
+    def hgLogin(self, hgsid, s, params, body):
+        username = params.get('hgLogin_username')
+        if self.users is not None \
+                and self.users.get(username) != params.get('hgLogin_password'):
+            return self._page(
+                hgsid, '<P><span class="error">Error</span> Invalid user '
+                'name or password.</P>')
+        with self._lock:
+            s.cart['hgLogin_username'] = username
+        return self._page(hgsid, '<h2>Login successful</h2>')
+
+    def hgSession(self, hgsid, s, params, body):
+        return self._page(hgsid, '<h2>Sessions</h2>')
+
+    def hgTrackUi(self, hgsid, s, params, body):
+        track = params.get('g')
+        known = [i[0] for i in self._tracks] + list(s.custom)
+        if track not in known:
+            return 404, 'text/html', 'No track "%s"' % _escape(track or '')
+        checkboxes = [('label.gene', 'on'), ('label.acc', '0'),
+                      ('hideNoncoding', '0')]
+        html = [
+            '<FORM ACTION="../cgi-bin/hgTracks" NAME="mainForm" METHOD=POST>',
+            "<INPUT TYPE=HIDDEN NAME='hgsid' VALUE='%s'>" % hgsid,
+            "<INPUT TYPE=HIDDEN NAME='g' VALUE='%s'>" % track,
+            '<B>Display mode:</B>',
+            self._select(track, self._visibility(s, track))]
+        for name, default in checkboxes:
+            name = '%s.%s' % (track, name)
+            checked = ' CHECKED' if s.cart.get(name, default) == 'on' else ''
+            html.append(
+                '<BR><INPUT TYPE=CHECKBOX NAME="%s" VALUE="on"%s>'
+                "<INPUT TYPE=HIDDEN NAME='boolshad.%s' VALUE='0'> %s"
+                % (name, checked, name, name))
+        name = track + '.baseColorDrawOpt'
+        html.append('<BR>' + self._select(
+            name, s.cart.get(name, 'none'), ['none', 'genomicCodons']))
+        name = track + '.maxItems'
+        html.append('<BR>' + self._select(
+            name, s.cart.get(name, '1000'), ['100', '1000', '10000']))
+        name = track + '.labelPos'
+        for value in ('left', 'right'):
+            checked = ' CHECKED' if s.cart.get(name, 'left') == value else ''
+            html.append('<INPUT TYPE=RADIO NAME="%s" VALUE="%s"%s> %s'
+                        % (name, value, checked, value))
+        name = track + '.scoreMin'
+        html.append('<BR><INPUT TYPE=TEXT NAME="%s" VALUE="%s" SIZE=4>'
+                    % (name, _escape(s.cart.get(name, '0'))))
+        html.append('<INPUT TYPE=SUBMIT NAME="Submit" VALUE="Submit">'
+                    '</FORM>')
+        return self._page(hgsid, '\n'.join(html))
+
+    def hgHubConnect(self, hgsid, s, params, body):
+        return self._page(hgsid, '<h2>Track Data Hubs</h2>')
+
+    # -------------------------------------------------------------------------
+    # Page building
+
+    def _page(self, hgsid, content):
+        return 200, 'text/html', (
+            '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN">\n'
+            '<HTML><HEAD><TITLE>Mock Genome Browser</TITLE></HEAD><BODY>\n'
+            '<FORM ACTION="../cgi-bin/hgTracks" NAME="TrackHeaderForm" '
+            'METHOD="GET">\n'
+            '<INPUT TYPE=HIDDEN NAME="hgsid" VALUE="%s">\n%s\n</FORM>\n'
+            '</BODY></HTML>\n' % (hgsid, content))
+
+    def _select(self, name, selected, options=VISIBILITIES):
+        return '<SELECT NAME="%s" style="width: 70px">%s</SELECT>' % (
+            name, ''.join(
+                '<OPTION%s>%s</OPTION>' % (' SELECTED' if i == selected else '',
+                                           i)
+                for i in options))
+
+    def _visibility(self, s, track):
+        default = 'dense' if track.endswith(('0', '5')) else 'hide'
+        return s.cart.get(track, default)
+
+    def _track_cell(self, hgsid, s, track, label, title):
+        return (
+            '<TD NOWRAP><A HREF="../cgi-bin/hgTrackUi?hgsid=%s&c=chr1&g=%s" '
+            'title="%s">%s</A><BR>\n%s</TD>'
+            % (hgsid, track, _escape(title), _escape(label),
+               self._select(track, self._visibility(s, track))))
+
+    def _track_table(self, hgsid, s):
+        db = _escape(s.cart.get('db', ''))
+        html = ['<INPUT TYPE=HIDDEN NAME="db" VALUE="%s">' % db,
+                '<B>%s</B> %s' % (db, _escape(s.cart.get('position', ''))),
+                self._image_map(s)]
+        groups = collections.OrderedDict()
+        if s.custom:
+            groups['Custom Tracks'] = [
+                (i, label, label) for i, (label, n) in s.custom.items()]
+        for track, label, title, group in self._tracks:
+            groups.setdefault(group, []).append((track, label, title))
+        for n, (group, tracks) in enumerate(groups.items()):
+            html.append(
+                '<TABLE BORDER=0 CELLSPACING=1 CELLPADDING=1 WIDTH=100%%>\n'
+                '<TR><TD><INPUT TYPE="IMAGE" CLASS="toggleButton" '
+                'ID="group%s_button" SRC="../images/remove_sm.gif"></TD>'
+                '<TD COLSPAN=3><B>%s</B></TD>'
+                '<TD><INPUT TYPE=SUBMIT NAME="hgt.refresh" VALUE="refresh">'
+                '</TD></TR>\n' % (n, _escape(group)))
+            for i in range(0, len(tracks), 3):
+                html.append('<TR>' + ''.join(
+                    self._track_cell(hgsid, s, *t) for t in tracks[i:i + 3])
+                    + '</TR>')
+            html.append('</TABLE>')
+        return '\n'.join(html)
+
+    def _image_map(self, s):
+        """
+        Image map markup (as for the browser graphic) of about self.padding
+        bytes.
+        """
+        area = ('<AREA SHAPE=RECT COORDS="%s,%s,%s,%s" '
+                'HREF="../cgi-bin/hgc?c=chr1&o=%s&t=%s&g=track%03d" '
+                'TITLE="item %s">\n')
+        areas = []
+        size = 0
+        i = 0
+        while size < self.padding:
+            a = area % (i % 800, i % 300, i % 800 + 5, i % 300 + 8, i * 100,
+                        i * 100 + 50, i % max(self.n_tracks, 1), i)
+            areas.append(a)
+            size += len(a)
+            i += 1
+        return '<MAP NAME="map_data">\n%s</MAP>' % ''.join(areas)
+
+    def _zoom(self, s, factor):
+        m = _POSITION.match(s.cart.get('position', ''))
+        if not m:
+            return
+        chrom, start, stop = m.group(1), int(m.group(2).replace(',', '')), \
+            int(m.group(3).replace(',', ''))
+        center = (start + stop) / 2.0
+        half = max((stop - start) * factor / 2.0, 10)
+        s.cart['position'] = '%s:%d-%d' % (chrom, max(center - half, 1),
+                                           center + half)
+
+    def pdf(self, name):
+        """
+        Return (status, content type, body) for a rendered PDF.
+        """
+        with self._lock:
+            ready = self.trash.get(name)
+        if ready is None or time.time() < ready:
+            return 404, 'text/html', 'Not Found'
+        head = '%PDF-1.4\n% mock ucscsession PDF\n'
+        return 200, 'application/pdf', (
+            head + ' ' * max(self.pdf_size - len(head) - 6, 0) + '%%EOF\n')
+
+
+class MockUCSCProcess(object):
+    """
+    MockUCSC running in a child process, so that measurements of the
+    client (e.g., its peak memory or CPU time) don't include the server.
+
+    Takes the same arguments as MockUCSC, and has the same url, requests,
+    reset_counts(), start() and stop(); `requests` is fetched from the child
+    process each time it is read.
+    """
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._conn = None
+        self._process = None
+        self.url = None
+
+    def __repr__(self):
+        return '<MockUCSCProcess %s>' % self.url
+
+    def start(self):
+        self._conn, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve, args=(child, self._kwargs))
+        self._process.daemon = True
+        self._process.start()
+        self.url = self._conn.recv()
+        return self
+
+    def _call(self, command):
+        self._conn.send(command)
+        return self._conn.recv()
+
+    @property
+    def requests(self):
+        return self._call('requests')
+
+    def reset_counts(self):
+        self._call('reset_counts')
+
+    def stop(self):
+        self._call('stop')
+        self._process.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def _serve(conn, kwargs):
+    """
+    Run a MockUCSC, answering commands from MockUCSCProcess over `conn`.
+    """
+    server = MockUCSC(**kwargs).start()
+    conn.send(server.url)
+    while True:
+        command = conn.recv()
+        if command == 'requests':
+            conn.send(collections.Counter(server.requests))
+        elif command == 'reset_counts':
+            server.reset_counts()
+            conn.send(None)
+        elif command == 'stop':
+            server.stop()
+            conn.send(None)
+            return
+
+
+def _escape(s):
+    return s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')\
+        .replace('"', '&quot;')
+
+
+def _params(query, body, content_type):
+    """
+    Dictionary of CGI parameters (last value wins) from the query string and
+    a form-encoded body.
+    """
+    params = {}
+    for k, v in urlparse.parse_qsl(query, keep_blank_values=True):
+        params[k] = v
+    if body and content_type.startswith('application/x-www-form-urlencoded'):
+        for k, v in urlparse.parse_qsl(body, keep_blank_values=True):
+            params[k] = v
+    return params
+
+
+def _multipart_file(body, content_type):
+    """
+    Return (filename, data) for the first file in a multipart/form-data body,
+    or None.
+    """
+    m = re.search(r'boundary=([^;\s]+)', content_type)
+    if not m:
+        return None
+    for part in body.split('--' + m.group(1).strip('"')):
+        head, sep, data = part.partition('\r\n\r\n')
+        fn = re.search(r'filename="([^"]*)"', head)
+        if sep and fn:
+            if data.endswith('\r\n'):
+                data = data[:-2]
+            return fn.group(1), data
+
+
+def _apply(cart, params):
+    """
+    Update `cart` from request parameters, as the real CGIs do for any
+    variables they're sent.
+    """
+    for k, v in params.items():
+        if k in ('hgsid', 'g', 'c', 'Submit', 'action') \
+                or k.startswith(('hgt.', 'hgLogin_')):
+            continue
+        if k.startswith('boolshad.'):
+            if k[len('boolshad.'):] not in params:
+                cart[k[len('boolshad.'):]] = '0'
+            continue
+        cart[k] = v
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Keep-alive, so ucscsession's connection pooling is exercised
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        """
+        Return the request body, or None if it was sent with chunked
+        transfer encoding -- which, like the real CGIs, the mock rejects
+        (after reading it, so the client sees the response).
+        """
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            while True:
+                size = int(self.rfile.readline().split(';')[0].strip(), 16)
+                if size == 0:
+                    # Trailers, then a blank line
+                    while self.rfile.readline().strip():
+                        pass
+                    return None
+                self.rfile.read(size)
+                self.rfile.readline()
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else ''
+
+    def _handle(self):
+        mock = self.server.mock
+        url = urlparse.urlsplit(self.path)
+        path = posixpath.normpath(url.path)
+        body = self._read_body()
+        if body is None:
+            return self._send(411, 'text/html', 'Length Required')
+        if path.startswith('/trash/hgt/'):
+            mock.requests['trash'] += 1
+            status, content_type, content = mock.pdf(posixpath.basename(path))
+            return self._send(status, content_type, content)
+
+        cgi = posixpath.basename(path)
+        method = getattr(mock, cgi, None)
+        if not path.startswith('/cgi-bin/') or method is None:
+            return self._send(404, 'text/html', 'Not Found')
+        mock.requests[cgi] += 1
+        delay = mock.delay(cgi)
+        if delay:
+            time.sleep(delay)
+
+        content_type = self.headers.get('Content-Type', '')
+        params = _params(url.query, body, content_type)
+        mock.last_params[cgi] = params
+        upload = None
+        if content_type.startswith('multipart/form-data'):
+            upload = _multipart_file(body, content_type)
+        hgsid, session = mock.session(params.get('hgsid'))
+        if cgi != 'hgLogin':
+            with mock._lock:
+                _apply(session.cart, params)
+        status, content_type, content = method(hgsid, session, params, upload)
+        self._send(status, content_type, content)
+
+    def _send(self, status, content_type, content):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    do_GET = do_POST = do_HEAD = _handle
+
+
+class _ThreadingServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, *args):
+        BaseHTTPServer.HTTPServer.__init__(self, *args)
+        self._connections = set()
+        self._threads = []
+
+    def process_request(self, request, client_address):
+        self._connections.add(request)
+        thread = threading.Thread(target=self.process_request_thread,
+                                  args=(request, client_address))
+        thread.daemon = True
+        self._threads = [i for i in self._threads if i.is_alive()]
+        self._threads.append(thread)
+        thread.start()
+
+    def shutdown_request(self, request):
+        self._connections.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def close_connections(self):
+        """
+        Close kept-alive connections, so their handler threads finish.
+        """
+        for request in list(self._connections):
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def join_threads(self, timeout=5):
+        """
+        Wait for handler threads to finish (e.g., after close_connections()).
+        """
+        deadline = time.time() + timeout
+        for thread in list(self._threads):
+            thread.join(max(deadline - time.time(), 0))
+
+    def handle_error(self, request, client_address):
+        # Clients disconnecting (or connections closed by stop()) aren't
+        # errors worth reporting
+        pass
@@ -0,0 +1,68 @@
+"""
+Tests of ucscsession.hub that don't need the UCSC command-line tools.
+"""
+import pytest
+import requests
+from ucscsession import hub
+
+
+@pytest.fixture
+def served(tmpdir):
+    tmpdir.join('data.bb').write('0123456789' * 10)
+    server = hub.serve(str(tmpdir))
+    yield server.url
+    server.shutdown()
+    server.server_close()
+
+
+def get(url, range_=None):
+    headers = {}
+    if range_ is not None:
+        headers['Range'] = range_
+    return requests.get(url + '/data.bb', headers=headers)
+
+
+def test_serve_localhost_only(served):
+    assert served.startswith('http://127.0.0.1:')
+
+
+def test_whole_file(served):
+    r = get(served)
+    assert r.status_code == 200
+    assert len(r.content) == 100
+
+
+def test_range(served):
+    r = get(served, 'bytes=0-9')
+    assert r.status_code == 206
+    assert r.content == '0123456789'
+    assert r.headers['Content-Range'] == 'bytes 0-9/100'
+    assert r.headers['Content-Length'] == '10'
+
+
+def test_open_ended_range(served):
+    r = get(served, 'bytes=95-')
+    assert (r.status_code, r.content) == (206, '56789')
+
+
+def test_suffix_range(served):
+    r = get(served, 'bytes=-3')
+    assert (r.status_code, r.content) == (206, '789')
+    assert r.headers['Content-Range'] == 'bytes 97-99/100'
+
+
+def test_range_end_clamped(served):
+    r = get(served, 'bytes=98-1000')
+    assert (r.status_code, r.content) == (206, '89')
+    assert r.headers['Content-Range'] == 'bytes 98-99/100'
+
+
+def test_unsatisfiable_range(served):
+    assert get(served, 'bytes=100-200').status_code == 416
+    assert get(served, 'bytes=5-2').status_code == 416
+
+
+def test_hub_name():
+    with pytest.raises(ValueError) as e:
+        hub.TrackHub('out', 'hg19', name='my/hub')
+    assert 'letters, digits' in str(e.value)
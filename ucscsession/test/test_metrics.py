@@ -0,0 +1,90 @@
+"""
+Tests of ucscsession.metrics.
+"""
+import gzip
+import io
+import threading
+import BaseHTTPServer
+
+import pytest
+import requests
+from ucscsession.metrics import Metrics
+
+BODY = 'chr1\t0\t100\n' * 1000
+
+
+def _gzipped(data):
+    buf = io.BytesIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = _gzipped(BODY)
+        self.send_response(200)
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Connection', 'close')
+        if self.path == '/cgi-bin/hgLength':
+            self.send_header('Content-Length', str(len(body)))
+        else:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        if self.path == '/cgi-bin/hgLength':
+            self.wfile.write(body)
+            return
+        for i in range(0, len(body), 1000):
+            chunk = body[i:i + 1000]
+            self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.write('0\r\n\r\n')
+
+
+@pytest.fixture
+def url():
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%s/cgi-bin/' % server.server_address[1]
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def received(url, stream=False):
+    # Recorded from a hook, as sessions do, before requests reads the body
+    metrics = Metrics()
+
+    def hook(response, **kwargs):
+        metrics.record_response(response, kwargs.get('stream'))
+
+    response = requests.get(url, stream=stream, hooks={'response': hook})
+    name = url.rsplit('/', 1)[-1]
+    return response, metrics.requests[name].received
+
+
+def test_received_counts_compressed_bytes(url):
+    response, n = received(url + 'hgLength')
+    assert response.content == BODY
+    assert n == len(_gzipped(BODY))
+
+
+def test_received_chunked_counts_compressed_bytes(url):
+    # Without a Content-Length, the body is read and counted as it arrived,
+    # not after decoding -- so it agrees with the case above
+    response, n = received(url + 'hgChunked')
+    assert response.content == BODY
+    assert n == len(_gzipped(BODY))
+
+
+def test_received_streamed_without_length(url):
+    response, n = received(url + 'hgChunked', stream=True)
+    assert n == 0
+    assert response.content == BODY
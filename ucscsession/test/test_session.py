@@ -0,0 +1,406 @@
+"""
+Tests of sessions against the mock Genome Browser in
+ucscsession.test.mockucsc.
+"""
+import os
+import time
+import threading
+import pytest
+import ucscsession
+from ucscsession import SessionPool, upload
+from ucscsession.dedup import UploadIndex
+from ucscsession.catalog import TrackCatalog
+from ucscsession.tracks import iter_track_records
+from ucscsession.test.mockucsc import MockUCSC
+from ucscsession.test.debug.parser_benchmark import Page, soup_tracks
+
+
+@pytest.fixture
+def server():
+    with MockUCSC(latency=0.01, n_tracks=20, padding=1000,
+                  pdf_delay=0) as s:
+        yield s
+
+
+@pytest.fixture
+def bed(tmpdir):
+    def make(name, n=10):
+        fn = str(tmpdir.join(name + '.bed'))
+        fout = open(fn, 'w')
+        for i in range(n):
+            fout.write('chr1\t%s\t%s\n' % (i * 100, i * 100 + 50))
+        fout.close()
+        return fn
+    return make
+
+
+def custom_tracks(u):
+    return sorted(k for k in u.tracks if k.startswith('ct_'))
+
+
+# -----------------------------------------------------------------------------
+# batch() and the cart
+
+def test_batch_cart_read_keeps_pending_changes(server):
+    u = ucscsession.new_session(server.url)
+    with u.batch():
+        u.set_genome('mm9')
+        # Not changed locally, so this syncs the cart from the server
+        assert u.cart['position'] == 'chr1:1-10000'
+        assert u.cart['db'] == 'mm9'
+    assert u.cart['db'] == 'mm9'
+    assert u.cart.sync()['db'] == 'mm9'
+    assert server.sessions[u.hgsid].cart['db'] == 'mm9'
+
+
+def test_batch_sends_changes_once(server):
+    u = ucscsession.new_session(server.url)
+    u.hgsid
+    server.reset_counts()
+    with u.batch():
+        u.set_genome('mm9')
+        u.set_position('chr2:1-2000')
+        assert server.requests['hgTracks'] == 0
+    assert dict(server.requests) == {'hgTracks': 1}
+    cart = server.sessions[u.hgsid].cart
+    assert (cart['db'], cart['position']) == ('mm9', 'chr2:1-2000')
+
+
+def test_batch_tracks_include_pending_changes(server):
+    u = ucscsession.new_session(server.url)
+    with u.batch():
+        u.set_genome('mm9')
+        assert 'track000' in u.tracks
+        # The refresh sent the pending change along with it
+        assert server.sessions[u.hgsid].cart['db'] == 'mm9'
+    assert server.requests['hgTracks'] == 1
+
+
+def test_batch_ends_when_flush_fails(server):
+    u = ucscsession.new_session(server.url)
+    u.hgsid
+
+    def fail(data=None):
+        raise IOError('connection lost')
+    u.request_tracks = fail
+    with pytest.raises(IOError):
+        with u.batch():
+            u.set_position('chr2:1-2000')
+    del u.request_tracks
+    assert u._batch is None
+    assert u.set_position('chr3:1-2000') is not None
+    assert server.sessions[u.hgsid].cart['position'] == 'chr3:1-2000'
+
+
+def test_batch_discards_changes_on_error(server):
+    u = ucscsession.new_session(server.url)
+    with pytest.raises(ZeroDivisionError):
+        with u.batch():
+            u.set_position('chr2:1-2000')
+            1 / 0
+    assert u._batch is None
+    assert u.cart['position'] == 'chr1:1-10000'
+
+
+def test_catalog_after_set_genome(server, tmpdir):
+    catalog = TrackCatalog(str(tmpdir.join('catalog.db')))
+    u = ucscsession.new_session(server.url)
+    u.catalog = catalog
+    u.set_genome('mm9')
+    assert 'track000' in u.tracks
+    u.set_genome('hg19')
+    assert 'track000' in u.tracks
+    server.reset_counts()
+    u.set_genome('mm9')
+    assert 'track000' in u.tracks
+    assert dict(server.requests) == {'cartDump': 1}
+
+
+def test_save_and_restore_state(server, tmpdir):
+    u = ucscsession.new_session(server.url)
+    u.set_genome('mm9')
+    fn = u.save_state(str(tmpdir.join('state.json')))
+    server.reset_counts()
+    v = ucscsession.from_state(fn)
+    assert v.hgsid == u.hgsid
+    assert v.cart['db'] == 'mm9'
+    assert sum(server.requests.values()) == 0
+
+
+def test_pool_discards_session_on_error(server):
+    pool = SessionPool(mirror=server.url)
+    with pytest.raises(ZeroDivisionError):
+        with pool.lease() as u:
+            1 / 0
+    assert pool.size == 0
+    with pool.lease() as u:
+        pass
+    assert pool.size == 1
+
+
+def test_pool_warm(server):
+    pool = SessionPool(max_size=2, mirror=server.url)
+    assert pool.warm(-1) == 0
+    assert pool.warm(5) == 2
+    assert (len(pool._idle), pool._leased) == (2, 0)
+    assert server.requests['hgGateway'] == 2
+
+
+# -----------------------------------------------------------------------------
+# Concurrent first use
+
+def test_concurrent_hgsid(server):
+    u = ucscsession.new_session(server.url)
+    hgsids = []
+    threads = [threading.Thread(target=lambda: hgsids.append(u.hgsid))
+               for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert set(hgsids) == set([u.hgsid])
+    assert server.requests['hgGateway'] == 1
+    assert len(server.sessions) == 1
+
+
+def test_concurrent_pdf_batch(server, tmpdir):
+    u = ucscsession.new_session(server.url)
+    positions = ['chr1:%s-%s' % (i * 1000 + 1, i * 1000 + 2000)
+                 for i in range(8)]
+    results = u.pdf_batch(positions, str(tmpdir), workers=8)
+    results.raise_for_errors()
+    assert all(os.path.exists(r.value) for r in results)
+    assert server.requests['hgGateway'] == 1
+    assert len(server.sessions) == 1
+
+
+# -----------------------------------------------------------------------------
+# Uploads
+
+def test_upload_tracks_concurrently(server, bed):
+    u = ucscsession.new_session(server.url)
+    tracks = [(bed('t%s' % i), 'track name=t%s' % i) for i in range(4)]
+    results = u.upload_tracks(tracks, workers=4)
+    results.raise_for_errors()
+    assert len(custom_tracks(u)) == 4
+    assert len(server.sessions) == 1
+
+
+def test_upload_compressed(server, bed):
+    u = ucscsession.new_session(server.url)
+    fn = bed('big', n=5000)
+    response = u.upload_track(fn, 'track name=big', compress=True)
+    assert 'Content-Length' in response.request.headers
+    assert server.sessions[u.hgsid].custom.values() == [('big', 5000)]
+
+
+def test_compressed_body_length(bed):
+    fn = bed('big', n=5000)
+    body = upload.track_body(fn, 'track name=big', compress=True)
+    assert len(body.read()) == body.len
+
+
+def test_gzip_chunks_stops_with_consumer():
+    before = threading.active_count()
+    chunks = upload.gzip_chunks(iter(['x' * 100000] * 1000), queue_size=1)
+    next(chunks)
+    chunks.close()
+    for i in range(50):
+        if threading.active_count() == before:
+            break
+        time.sleep(0.05)
+    assert threading.active_count() == before
+
+
+def test_upload_to_another_cart_fails(server, bed):
+    u = ucscsession.new_session(server.url)
+    u.session.params.pop('hgsid')
+    with pytest.raises(ValueError):
+        u.upload_track(bed('t'))
+
+
+def test_upload_after_login(server, bed):
+    u = ucscsession.new_session(server.url)
+    u.login('user', 'password')
+    # As if hgLogin had answered with another hgsid, which login() records
+    # but doesn't send with later requests
+    u._set_hgsid('1')
+    u.upload_track(bed('t'))
+    assert len(custom_tracks(u)) == 1
+
+
+def test_upload_error(server, tmpdir):
+    u = ucscsession.new_session(server.url)
+    fn = str(tmpdir.join('bad.bed'))
+    open(fn, 'w').write('chr1\tnot\tcoordinates\n')
+    with pytest.raises(ValueError):
+        u.upload_track(fn)
+
+
+def test_upload_dedup(server, bed):
+    u = ucscsession.new_session(server.url)
+    u.upload_index = UploadIndex()
+    a, b = bed('a'), bed('b')
+    assert u.upload_track(a, 'track name=a') is not None
+    assert u.upload_track(a, 'track name=a') is None
+    assert u.upload_track(b, 'track name=b') is not None
+    # A different track line is a different upload
+    assert u.upload_track(a, 'track name=a2') is not None
+    assert server.requests['hgCustom'] == 3
+    assert len(custom_tracks(u)) == 3
+
+
+def test_upload_dedup_after_replacement(server, bed):
+    u = ucscsession.new_session(server.url)
+    u.upload_index = UploadIndex()
+    a, b = bed('a'), bed('b', n=20)
+    assert u.upload_track(a, 'track name=same') is not None
+    # Replaces the first track, so its cart variable now holds b
+    assert u.upload_track(b, 'track name=same') is not None
+    assert u.upload_track(a, 'track name=same') is not None
+    assert server.requests['hgCustom'] == 3
+    assert server.sessions[u.hgsid].custom.values() == [('same', 10)]
+
+
+# -----------------------------------------------------------------------------
+# Track parsing
+
+# Cells unlike the mock's: an extra icon link (as for lifted-over tracks), no
+# title, entities in the label, lowercase tags and unquoted attributes
+EXTRA_CELLS = """
+<TABLE><TR>
+<TD><A HREF="../cgi-bin/hgTrackUi?g=lifted&amp;c=chr1"><IMG SRC="icon.gif"></A>
+<A HREF="../cgi-bin/hgTrackUi?g=lifted&amp;c=chr1">Lifted &amp; Moved</A><BR>
+<SELECT NAME="lifted"><OPTION>hide</OPTION><OPTION SELECTED>dense</OPTION>
+</SELECT></TD>
+<td><a href=../cgi-bin/hgTrackUi?g=plain title='Plain &quot;track&quot;'>
+ Plain </a><br><select name=plain><option selected>hide<option>full</select>
+</td>
+</TR></TABLE>
+"""
+
+
+def tracks_page(u, bed):
+    """
+    Text of an hgTracks page with a custom track and EXTRA_CELLS.
+    """
+    u.upload_track(bed('mine'), 'track name="My BED"')
+    response = u.session.get(u.tracks_url)
+    return response.text.replace('</BODY>', EXTRA_CELLS + '</BODY>')
+
+
+def test_track_records_match_soup_tracks(server, bed):
+    u = ucscsession.new_session(server.url)
+    text = tracks_page(u, bed)
+    records = list(iter_track_records([text], u.url))
+    expected = soup_tracks(Page(text, u.tracks_url), u.url)
+    assert len(records) == len(expected) == 20 + 3
+    for record in records:
+        track = expected[record.id]
+        assert (record.label, record.title, record.url, record.visibility,
+                list(record.visibility_options)) == \
+            (track.label, track.title, track.url, track.visibility,
+             track._visibility_options)
+
+
+def test_track_records_from_chunks(server, bed):
+    u = ucscsession.new_session(server.url)
+    text = tracks_page(u, bed)
+    expected = list(iter_track_records([text], u.url))
+    for size in (7, 100, 4096):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert list(iter_track_records(chunks, u.url)) == expected
+
+
+# -----------------------------------------------------------------------------
+# Track configuration
+
+def test_configure_tracks(server):
+    u = ucscsession.new_session(server.url)
+    u.configure_tracks({
+        'track004': {'track004': 'pack', 'label.acc': 'on'},
+        'track005': {'baseColorDrawOpt': 'genomicCodons'}})
+    cart = server.sessions[u.hgsid].cart
+    assert cart['track004'] == 'pack'
+    assert cart['track004.label.acc'] == 'on'
+    assert cart['track005.baseColorDrawOpt'] == 'genomicCodons'
+    assert u.tracks['track004'].visibility == 'pack'
+
+
+def test_configure_tracks_failure_discards_changes(server):
+    u = ucscsession.new_session(server.url)
+    with pytest.raises(ValueError):
+        u.configure_tracks({
+            'track004': {'track004': 'pack'},
+            'track005': {'track005': 'bogus'}})
+    assert server.requests['hgTrackUi'] == 2
+    assert 'track004' not in server.sessions[u.hgsid].cart
+    assert u.tracks['track004'].config.data() == {
+        'hgsid': u.hgsid, 'g': 'track004'}
+
+
+def test_config_page_controls(server):
+    u = ucscsession.new_session(server.url)
+    form = u.tracks['track004'].config.forms[-1]
+    controls = dict((c.name, c) for c in form.controls)
+    assert (controls['track004'].type, controls['track004'].value) == \
+        ('select', ['hide'])
+    assert controls['track004.label.gene'].type == 'checkbox'
+    assert controls['track004.label.gene'].value == ['on']
+    assert controls['track004.label.acc'].value == []
+    assert controls['track004.label.acc'].options == ['on']
+    assert controls['track004.labelPos'].type == 'radio'
+    assert controls['track004.labelPos'].options == ['left', 'right']
+    assert controls['track004.labelPos'].value == ['left']
+    assert (controls['track004.scoreMin'].type,
+            controls['track004.scoreMin'].value) == ('text', '0')
+    assert controls['boolshad.track004.label.acc'].type == 'hidden'
+    assert 'Submit' not in form.data(changed_only=False)
+
+
+def test_config_page_submit(server):
+    u = ucscsession.new_session(server.url)
+    config = u.tracks['track004'].config
+    config['track004'] = 'pack'
+    config['track004.label.acc'] = 'on'
+    config['track004.labelPos'] = 'right'
+    config['track004.scoreMin'] = '100'
+    config.submit()
+    params = server.last_params['hgTrackUi']
+    # The changed controls plus hidden ones (including those in the page's
+    # URL); boolshad.* only for the changed checkbox
+    assert sorted(params) == [
+        'boolshad.track004.label.acc', 'c', 'g', 'hgsid', 'track004',
+        'track004.label.acc', 'track004.labelPos', 'track004.scoreMin']
+    cart = server.sessions[u.hgsid].cart
+    assert cart['track004'] == 'pack'
+    assert cart['track004.label.acc'] == 'on'
+    assert cart['track004.labelPos'] == 'right'
+    assert cart['track004.scoreMin'] == '100'
+
+
+def test_config_page_uncheck(server):
+    u = ucscsession.new_session(server.url)
+    config = u.tracks['track004'].config
+    config['track004.label.gene'] = []
+    config.submit()
+    params = server.last_params['hgTrackUi']
+    assert 'boolshad.track004.label.gene' in params
+    assert 'boolshad.track004.label.acc' not in params
+    assert server.sessions[u.hgsid].cart['track004.label.gene'] == '0'
+
+
+def test_control_set(server):
+    u = ucscsession.new_session(server.url)
+    config = u.tracks['track004'].config
+    with pytest.raises(ValueError):
+        config['track004'] = 'bogus'
+    with pytest.raises(ValueError):
+        config['track004'] = ['pack', 'full']
+    with pytest.raises(ValueError):
+        config['track004.labelPos'] = ['left', 'right']
+    with pytest.raises(ValueError):
+        config['track004.label.acc'] = 'off'
+    assert config.data() == {'hgsid': u.hgsid, 'g': 'track004'}
+    config['track004.maxItems'] = 100
+    assert config['track004.maxItems'] == ['100']
@@ -1,33 +1,67 @@
 import os
-from bs4 import BeautifulSoup
-import mechanize
+import re
+import hashlib
+from forms import forms_from_response
+from collections import namedtuple
+from HTMLParser import HTMLParser
 import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-# API goal:
-#
-# track.config['ct_bbed_5663.scoreFilter'] = 100
-# track.config['ct_bbed_5663'] = 'squish'
-# track.config.submit()
+class ConfigPage(object):
+    """
+    A track's configuration page.
 
+    `forms` is a list of ucscsession.forms.Form objects.  Controls can also
+    be set directly on the page, in which case the form containing the
+    control is found automatically, e.g.::
 
-class ConfigPage(object):
+        track.config['ct_bbed_5663.scoreFilter'] = 100
+        track.config['ct_bbed_5663'] = 'squish'
+        track.config.submit()
+    """
     def __init__(self, url, ucsc_session):
-        response = mechanize.urlopen(url)
-        self.forms = mechanize.ParseResponse(response, backwards_compat=False)
+        response = ucsc_session.session.get(url)
+        self.forms = ucsc_session._parse('forms', forms_from_response,
+                                         response)
         self.ucsc_session = ucsc_session
         self.url = url
 
-    def submit(self):
+    def _form_for(self, name):
+        for form in self.forms:
+            if name in form:
+                return form
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return any(name in form for form in self.forms)
+
+    def __getitem__(self, name):
+        return self._form_for(name)[name]
+
+    def __setitem__(self, name, value):
+        self._form_for(name)[name] = value
+
+    def data(self, changed_only=True, hidden=True):
+        """
+        Dictionary of data to submit from all forms; see Form.data().
+        """
         data = {}
         for form in self.forms:
-            text_data = form.click_request_data()[1]
-            data.update(dict([i.split('=') for i in text_data.split('&')]))
+            data.update(form.data(changed_only=changed_only, hidden=hidden))
+        return data
+
+    def submit(self):
+        """
+        Send the changed controls in a single request.
+        """
+        data = self.data()
         logger.debug('data = ' + str(data))
+        self.ucsc_session.flush()
         response = self.ucsc_session.session.get(
             self.url, params=data)
+        self.ucsc_session.cart.invalidate()
         self.ucsc_session._reset_tracks()
         return response
 
@@ -35,76 +69,44 @@ class ConfigPage(object):
         for i, form in enumerate(self.forms):
             print "forms[{0}]".format(i)
             for control in form.controls:
-                try:
-                    if control.type in ['hidden', 'submit']:
-                        continue
-                except (KeyError, AttributeError):
-                    pass
+                if control.type in ['hidden', 'submit']:
+                    continue
                 print '   {0}'.format(control)
 
 
-class TrackException(Exception):
-    pass
+TrackRecord = namedtuple(
+    'TrackRecord',
+    ['id', 'label', 'title', 'url', 'visibility', 'visibility_options'])
 
 
 class Track(object):
-    def __init__(self, td,  ucsc_session):
+    """
+    A track in the current session.
+
+    Only the fields extracted from the hgTracks page are kept (as an
+    immutable TrackRecord), so holding many Tracks doesn't keep any parsed
+    HTML alive.
+    """
+    __slots__ = ['_record', 'ucsc_session', '_config']
+
+    def __init__(self, record, ucsc_session):
         """
-        `td` is a <td> tag parsed with BeautifulSoup
+        `record` is a TrackRecord, as yielded by iter_track_records().
         """
-        self._td = td
+        self._record = record
         self.ucsc_session = ucsc_session
-
-        # Filter out <td> cells containing known sentinel text indicating it
-        # doesn't represent a track
-        td_str = str(td)
-        if 'toggleButton' in td_str:
-            raise TrackException(
-                '<td> contains a group toggle button:\n %s' % td_str)
-        if len(td('b')) > 0:
-            raise TrackException(
-                '<td> looks like a group title:\n %s' % td_str)
-        if 'hgt.refresh' in td_str:
-            raise TrackException(
-                '<td> looks like a refresh button:\n %s' % td_str)
-        if '[No data' in td_str:
-            raise TrackException(
-                '<td> is reporting no data for this chrom:\n %s' % td_str)
-
-        # Extract the config page URL for this track.
-        #
-        # Note: for liftedOver or ENCODE tracks, there's another <a> tag for
-        # the little icon thing, which will be the first <a> tag in the table
-        # cell.  Otherwise, there should be just one <a> tag.
-        a = td('a')
-        if (len(a) == 0):
-            raise TrackException('<td> has no <a> tag:\n %s' % td_str)
-        a = a[-1]
-        self.url = os.path.join(ucsc_session.url, a['href'])
-
-        # Extract the <select> and current visibility
-        select = td('select')
-        if len(select) != 1:
-            raise TrackException('<td> has no <select> tag:\n %s' % td_str)
-        select = select[0]
-        self.visibility = self._td('option', selected=True)[0].text
-        self._visibility_options = [i.text for i in self._td('option')]
-
-        # Extract out some other stuff useful for introspection
-        self.id = select['name']
-        self.label = a.text.strip()
-
-        # Sometimes there's no title; in that case set it to the label.
-        try:
-            self.title = a['title']
-        except KeyError:
-            self.title = self.label
         self._config = None
 
-    def __repr__(self):
-        return '<Track "{id}" ({label}) [{visibility}]>'\
-            .format(**self.__dict__)
+    id = property(lambda self: self._record.id)
+    label = property(lambda self: self._record.label)
+    title = property(lambda self: self._record.title)
+    url = property(lambda self: self._record.url)
+    visibility = property(lambda self: self._record.visibility)
+    _visibility_options = property(
+        lambda self: self._record.visibility_options)
 
+    def __repr__(self):
+        return '<Track "{0.id}" ({0.label}) [{0.visibility}]>'.format(self)
 
     @property
     def config(self):
@@ -123,14 +125,156 @@ class Track(object):
         return response
 
 
-def tracks_from_response(response, ucsc_session):
-    soup = BeautifulSoup(response.text)
-    cells = soup('td')
-    tracks = []
-    for cell in cells:
-        try:
-            track = Track(cell, ucsc_session)
-        except TrackException:
-            continue
-        tracks.append(track)
+_TD = re.compile(r'<td\b[^>]*>(.*?)</td\s*>', re.I | re.S)
+_TD_START = re.compile(r'<td\b', re.I)
+_SELECT_START = re.compile(r'<select\b', re.I)
+_B = re.compile(r'<b\b', re.I)
+_A = re.compile(r'<a\b([^>]*)>(.*?)</a\s*>', re.I | re.S)
+_SELECT = re.compile(r'<select\b([^>]*)>(.*?)</select\s*>', re.I | re.S)
+_OPTION = re.compile(r'<option\b([^>]*)>([^<]*)', re.I)
+_ATTR = re.compile(
+    r'''([\w.:-]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?''')
+_TAG = re.compile(r'<[^>]*>')
+_unescape = HTMLParser().unescape
+
+
+def _attrs(s):
+    """
+    Dictionary of attributes from the inside of a start tag; names are
+    lowercased and valueless attributes (like SELECTED) map to "".
+    """
+    return dict(
+        (m.group(1).lower(), _unescape(m.group(2) or m.group(3) or m.group(4)
+                                       or ''))
+        for m in _ATTR.finditer(s))
+
+
+def _record_from_cell(cell, base_url):
+    """
+    Return a TrackRecord for the inner HTML of a <td>, or None if the cell
+    doesn't represent a track.
+    """
+    # Filter out cells containing known sentinel text indicating they don't
+    # represent a track: group toggle buttons, group titles, the refresh
+    # button, and "no data for this chrom" notices.
+    if ('toggleButton' in cell) or ('hgt.refresh' in cell) \
+            or ('[No data' in cell) or _B.search(cell):
+        return None
+    a = _A.findall(cell)
+    select = _SELECT.findall(cell)
+    if len(a) == 0 or len(select) != 1:
+        return None
+
+    # The config page URL for this track.
+    #
+    # Note: for liftedOver or ENCODE tracks, there's another <a> tag for
+    # the little icon thing, which will be the first <a> tag in the table
+    # cell.  Otherwise, there should be just one <a> tag.
+    a_attrs, a_text = a[-1]
+    a_attrs = _attrs(a_attrs)
+    if 'href' not in a_attrs:
+        return None
+    label = _unescape(_TAG.sub('', a_text)).strip()
+
+    # The <select> and current visibility.  If nothing is explicitly
+    # selected, browsers show the first option.
+    select_attrs, select_html = select[0]
+    options = []
+    visibility = None
+    for option_attrs, text in _OPTION.findall(select_html):
+        text = _unescape(text).strip()
+        options.append(text)
+        if visibility is None and 'selected' in _attrs(option_attrs):
+            visibility = text
+    if not options:
+        return None
+    if visibility is None:
+        visibility = options[0]
+
+    return TrackRecord(
+        id=_attrs(select_attrs)['name'],
+        label=label,
+        # Sometimes there's no title; in that case use the label.
+        title=a_attrs.get('title', label),
+        url=os.path.join(base_url, a_attrs['href']),
+        visibility=visibility,
+        visibility_options=tuple(options))
+
+
+def iter_track_records(chunks, base_url):
+    """
+    Incrementally scan hgTracks HTML for track controls.
+
+    `chunks` is an iterable of strings (e.g., [response.text], or
+    response.iter_content(decode_unicode=True) for a streamed response).
+    `base_url` is used to make config page URLs absolute.
+
+    Only the text of the <td> currently being scanned is kept around, so
+    memory stays bounded even for very large pages.  Yields TrackRecord
+    objects.
+    """
+    buf = ''
+    for chunk in chunks:
+        buf += chunk
+        end = 0
+        for m in _TD.finditer(buf):
+            end = m.end()
+            record = _record_from_cell(m.group(1), base_url)
+            if record is not None:
+                yield record
+        buf = buf[end:]
+
+        # Discard text that can't be part of a cell, but keep a few trailing
+        # characters in case a "<td" is split across chunks.
+        m = _TD_START.search(buf)
+        if m is None:
+            buf = buf[-3:]
+        else:
+            buf = buf[m.start():]
+
+
+def controls_digest(text):
+    """
+    Return a digest of the part of an hgTracks page that holds the track
+    controls (from the cell holding the first <select> through the last
+    </select>).  If two pages have the same digest, they have the same
+    tracks.
+    """
+    m = _SELECT_START.search(text)
+    if m is None:
+        return None
+    start = max(text.rfind('<td', 0, m.start()),
+                text.rfind('<TD', 0, m.start()), 0)
+    end = max(text.rfind('</select'), text.rfind('</SELECT'))
+    section = text[start:end]
+    if isinstance(section, unicode):
+        section = section.encode('utf-8')
+    return hashlib.md5(section).hexdigest()
+
+
+def update_tracks(tracks, records, ucsc_session):
+    """
+    Update the dictionary `tracks` (of {id: Track}) in place from `records`.
+
+    Existing Track objects are kept for ids that are still present, and only
+    their records are replaced (if anything changed); tracks no longer on the
+    page are removed and new ones are added.
+    """
+    seen = set()
+    for record in records:
+        seen.add(record.id)
+        track = tracks.get(record.id)
+        if track is None:
+            tracks[record.id] = Track(record, ucsc_session)
+        elif track._record != record:
+            if track._record.url != record.url:
+                track._config = None
+            track._record = record
+    for k in set(tracks).difference(seen):
+        del tracks[k]
     return tracks
+
+
+def tracks_from_response(response, ucsc_session):
+    return [Track(i, ucsc_session)
+            for i in iter_track_records([response.text], ucsc_session.url)]
@@ -0,0 +1,65 @@
+"""
+Configuration of the HTTP connections used to talk to the Genome Browser.
+
+All requests made by a session go through a single requests.Session created
+by make_session(), so connections are pooled and kept alive between requests.
+"""
+import settings
+
+
+def make_session(pool_maxsize=None, max_retries=None, backoff_factor=None):
+    """
+    Return a new requests.Session with pooled, keep-alive connections.
+
+    Each host gets a pool of up to `pool_maxsize` connections; threads
+    beyond that wait for a free connection rather than opening more.
+    Failed connections and 5xx responses to idempotent requests are retried
+    up to `max_retries` times, waiting `backoff_factor` * (2 ** retry)
+    seconds between attempts.  Defaults for each come from the module-level
+    values in ucscsession.settings.
+
+    If settings.fixture_mode is set, responses are recorded to or replayed
+    from settings.fixture_dir; see ucscsession.fixtures.
+    """
+    # requests is imported here rather than at the top of the module, so that
+    # importing ucscsession stays fast
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.packages.urllib3.util.retry import Retry
+
+    if pool_maxsize is None:
+        pool_maxsize = settings.pool_maxsize
+    if max_retries is None:
+        max_retries = settings.max_retries
+    if backoff_factor is None:
+        backoff_factor = settings.backoff_factor
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(500, 502, 503, 504),
+        raise_on_status=False)
+    kwargs = dict(
+        pool_connections=pool_maxsize,
+        pool_maxsize=pool_maxsize,
+        pool_block=True,
+        max_retries=retry)
+    if settings.fixture_mode is None:
+        adapter = HTTPAdapter(**kwargs)
+    else:
+        import fixtures
+        store = fixtures.fixture_store(settings.fixture_dir)
+        if settings.fixture_mode == 'record':
+            adapter = fixtures.RecordingAdapter(store, **kwargs)
+        elif settings.fixture_mode == 'replay':
+            adapter = fixtures.ReplayAdapter(store)
+        else:
+            raise ValueError('settings.fixture_mode must be None, "record" '
+                             'or "replay"')
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+    return session
@@ -0,0 +1,304 @@
+"""
+Streaming request bodies for custom track uploads.
+
+Tracks are sent as a multipart/form-data body that is read lazily from the
+file (or BedTool) being uploaded, with any track line prepended on the fly,
+so memory use doesn't depend on the size of the track and no temporary files
+are written.  Large tracks can also be gzipped on the fly.
+
+The Genome Browser's CGIs read request bodies according to their
+Content-Length and don't accept chunked transfer encoding, so the size of
+every body must be known before it is sent.  For a compressed file, it is
+found by compressing the file once just to count the output bytes, then
+compressing it again as it is sent (zlib's output is the same each time).
+Only tracks that can be read just once -- BedTools created from streams or
+iterators -- are spooled first, in memory or (if larger than
+settings.upload_spool_size) to a temporary file.
+"""
+import os
+import sys
+import zlib
+import binascii
+import hashlib
+import Queue
+import tempfile
+import itertools
+import threading
+import settings
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def iter_file(fn, chunk_size=CHUNK_SIZE):
+    """
+    Yield successive chunks of file `fn`.
+    """
+    f = open(fn, 'rb')
+    try:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        f.close()
+
+
+def _is_bedtool(obj):
+    """
+    Whether `obj` is a pybedtools.BedTool.
+
+    pybedtools is slow to import, so it's only imported by the code that
+    creates BedTools; if it hasn't been imported, `obj` can't be one.
+    """
+    pybedtools = sys.modules.get('pybedtools')
+    return pybedtools is not None and isinstance(obj, pybedtools.BedTool)
+
+
+def track_source(track, trackline=None):
+    """
+    Return (chunks, length, filename) for the contents of `track`, a filename
+    or pybedtools.BedTool, with `trackline` (if any) prepended.
+
+    `chunks` is an iterator of strings.  `length` is the total size in bytes,
+    or None if it can't be known in advance (e.g., for a BedTool created from
+    a stream or iterator).
+    """
+    head = ''
+    if trackline:
+        head = trackline.rstrip() + '\n'
+    fn = track
+    if _is_bedtool(track):
+        fn = track.fn
+        if not (isinstance(fn, basestring) and os.path.exists(fn)):
+            chunks = itertools.chain([head], (str(i) for i in track))
+            return chunks, None, 'track.bed'
+    chunks = itertools.chain([head], iter_file(fn))
+    return chunks, len(head) + os.path.getsize(fn), os.path.basename(fn)
+
+
+def gzip_chunks(chunks, compresslevel=6, queue_size=8):
+    """
+    Compress an iterator of strings into gzip format on the fly.
+
+    Reading and compressing happen in a background thread (zlib releases the
+    GIL while compressing), so compression overlaps with sending the data.
+    At most `queue_size` compressed chunks are buffered.  If the consumer
+    stops early, the thread stops too.
+    """
+    queue = Queue.Queue(queue_size)
+    done = object()
+    stopped = threading.Event()
+
+    def put(item):
+        # Returns False if the consumer has gone away
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            z = zlib.compressobj(compresslevel, zlib.DEFLATED,
+                                 16 + zlib.MAX_WBITS)
+            for chunk in chunks:
+                compressed = z.compress(chunk)
+                if compressed and not put(compressed):
+                    return
+            if put(z.flush()):
+                put(done)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+def gzip_length(chunks, compresslevel=6):
+    """
+    Return the number of bytes gzip_chunks() would produce for `chunks`,
+    without keeping the compressed data.
+    """
+    z = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    length = 0
+    for chunk in chunks:
+        length += len(z.compress(chunk))
+    return length + len(z.flush())
+
+
+def _expect_length(chunks, length):
+    """
+    Pass through `chunks`, raising IOError if they don't add up to `length`
+    bytes (which would leave the server waiting for, or ignoring, data).
+    """
+    n = 0
+    for chunk in chunks:
+        n += len(chunk)
+        yield chunk
+    if n != length:
+        raise IOError('expected %s bytes of upload data, got %s'
+                      % (length, n))
+
+
+def spool(chunks, max_size=None):
+    """
+    Read an iterator of strings of unknown total size into a temporary file,
+    kept in memory unless it exceeds `max_size` bytes (by default,
+    settings.upload_spool_size).
+
+    Returns (chunks, length), where `chunks` re-reads the spooled data and
+    closes (and so removes) the file once exhausted.
+    """
+    if max_size is None:
+        max_size = settings.upload_spool_size
+    f = tempfile.SpooledTemporaryFile(max_size=max_size)
+    try:
+        for chunk in chunks:
+            f.write(chunk)
+        length = f.tell()
+        f.seek(0)
+    except Exception:
+        f.close()
+        raise
+
+    def read():
+        try:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            f.close()
+
+    return read(), length
+
+
+def track_digest(track, trackline=None):
+    """
+    Return a hex digest of the contents of `track` (a filename or
+    pybedtools.BedTool) with `trackline` prepended, reading it in chunks.
+
+    Returns None for tracks that can only be read once (BedTools created from
+    streams or iterators), since hashing them would consume them.
+    """
+    chunks, length, filename = track_source(track, trackline)
+    if length is None:
+        return None
+    h = hashlib.sha1()
+    for chunk in chunks:
+        h.update(chunk)
+    return h.hexdigest()
+
+
+class MultipartStream(object):
+    """
+    File-like multipart/form-data body with a single file field, whose
+    content is read lazily from `chunks`.
+
+    If `length` (the total size of `chunks`) is known, so is the size of the
+    body, and requests sends it with a Content-Length; otherwise it is sent
+    with chunked transfer encoding, which the Genome Browser's CGIs don't
+    accept (track_body() always gives a length).  `bytes_read` is the number
+    of bytes of the body read so far.
+    """
+    def __init__(self, field, filename, chunks, length=None):
+        self.boundary = binascii.hexlify(os.urandom(16))
+        head = (
+            '--%s\r\n'
+            'Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+            'Content-Type: application/octet-stream\r\n\r\n'
+            % (self.boundary, field, filename))
+        tail = '\r\n--%s--\r\n' % self.boundary
+        self.len = None
+        if length is not None:
+            self.len = len(head) + length + len(tail)
+        self._chunks = itertools.chain([head], chunks, [tail])
+        self._buf = ''
+        self._pos = 0
+        self.bytes_read = 0
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def __iter__(self):
+        if self._pos < len(self._buf):
+            rest = self._buf[self._pos:]
+            self.bytes_read += len(rest)
+            yield rest
+        self._buf = ''
+        self._pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self.bytes_read += len(chunk)
+                yield chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return ''.join(self)
+        parts = []
+        while size > 0:
+            if self._pos >= len(self._buf):
+                try:
+                    self._buf = next(self._chunks)
+                except StopIteration:
+                    break
+                self._pos = 0
+                continue
+            part = self._buf[self._pos:self._pos + size]
+            self._pos += len(part)
+            self.bytes_read += len(part)
+            size -= len(part)
+            parts.append(part)
+        return ''.join(parts)
+
+
+def track_body(track, trackline=None, field='hgt.customFile', compress=None,
+               compresslevel=None):
+    """
+    Return a MultipartStream for uploading `track` (a filename or
+    pybedtools.BedTool) with an optional `trackline`.
+
+    If `compress` is True, the track is gzipped on the fly; if False, it is
+    sent as-is.  If None, tracks are compressed if they are at least
+    settings.gzip_threshold bytes, or if their size can't be known in
+    advance.  `compresslevel` defaults to settings.gzip_level.
+
+    The body always has a known length, so it is sent with a Content-Length.
+    Compressed files are read twice to find it (see the module docstring),
+    and tracks that can only be read once are spooled with spool().
+    """
+    chunks, length, filename = track_source(track, trackline)
+    if compress is None:
+        compress = (settings.gzip_threshold is not None) and (
+            (length is None) or (length >= settings.gzip_threshold))
+    if compress:
+        if compresslevel is None:
+            compresslevel = settings.gzip_level
+        filename += '.gz'
+        if length is None:
+            chunks, length = spool(gzip_chunks(chunks, compresslevel))
+        else:
+            length = gzip_length(chunks, compresslevel)
+            chunks = _expect_length(
+                gzip_chunks(track_source(track, trackline)[0],
+                            compresslevel),
+                length)
+    elif length is None:
+        chunks, length = spool(chunks)
+    return MultipartStream(field, filename, chunks, length)